@@ -18,6 +18,7 @@ from qiskit.providers.fake_provider import FakeManila
 
 
 from library import setup
+from library.result_handler import MHETS_store
 from library.MHETS import MHETS_instance
 from library.operator_creation import LMG_hamiltonian
 from library.ansatz_creation import two_local, pma
@@ -32,11 +33,11 @@ from library.ansatz_creation import two_local, pma
 #     multi_beta_sim
 
 # __multi_beta_sim___
-# check_temp_dir
+# check_temp_dir -> MHETS_store, each completed beta is written in temp_dir
 # parallel single_beta_sim
 # build_multi_beta_result
 # write_data_to_file(multi_beta_result)
-# delete temp_dir
+# delete temp_dir -> store.clear()
 
 # __build_multi_beta_result__
 # multi_beta_result = first_single_beta_result.copy()
@@ -128,6 +129,9 @@ for N in [2]:
                     flag=flag,
                     tol=tol,
                     shots=shots,
+                    # Ignore If flag == statevector. Only tomography gives the system state
+                    # needed by the fidelity and trace distance plots
+                    estimator="tomography",
                 )
 
                 mhets = MHETS_instance(
@@ -138,6 +142,11 @@ for N in [2]:
                     flag=flag,
                     backend=backend,
                 )
+                # Completed betas of an interrupted run with the same options are loaded
+                # instead of optimized again
+                store = MHETS_store(
+                    path + file_name.replace(".pickle", "_temp/"), mhets.optimization_options
+                )
 
                 # RUNNING SIMULATION
                 if run_flag is True:
@@ -153,7 +162,9 @@ for N in [2]:
                             old_data = pickle.load(f)
                     except FileNotFoundError:
                         print("No file found. Optimize from scratch")
-                        multi_beta_result = mhets.multi_beta_optimization_from_scratch(betas)
+                        multi_beta_result = mhets.multi_beta_optimization_from_scratch(
+                            betas, store=store
+                        )
                     else:
                         print("File found. Append results")
                         new_betas = setup.setup_betas(old_betas=old_data["betas"], betas=betas)
@@ -161,7 +172,7 @@ for N in [2]:
                         print("betas_inserted", betas)
                         print("final_beta_list", new_betas)
                         multi_beta_result = mhets.multi_beta_optimization_from_data(
-                            betas=new_betas, old_data=old_data
+                            betas=new_betas, old_data=old_data, store=store
                         )
 
                 # WRITING DATA TO FILE
@@ -184,3 +195,4 @@ for N in [2]:
                         run_flag=run_flag,
                         pma_flag=pma_flag,
                     )
+                store.clear()
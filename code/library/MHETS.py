@@ -13,15 +13,42 @@ import numpy as np
 import time
 
 
-from scipy.optimize import minimize
+from scipy.optimize import minimize, differential_evolution
+from qiskit import transpile
 from qiskit.circuit import QuantumCircuit
-from qiskit.quantum_info import DensityMatrix, partial_trace
+from qiskit.quantum_info import DensityMatrix, Statevector, partial_trace
+from qiskit_experiments.framework import ExperimentData
 from qiskit_experiments.library import StateTomography
 
 
-from library import montecarlo, SPSA_lib
+from library import montecarlo, SPSA_lib, numpy_simulator
+from library import measurement_estimation, pauli_grouping, shadows
+from library.recorder import cost_recorder
+from library.archive import evaluation_archive
+from library.cost_cache import cost_cache
 from library.operator_creation import LMG_hamiltonian
-from library.ansatz_creation import two_local
+from library.ansatz_creation import two_local, run_parameter_binds
+
+
+# scipy.optimize.minimize methods that use the gradient
+GRADIENT_OPTIMIZERS = ["l-bfgs-b", "slsqp", "bfgs", "cg", "tnc"]
+
+
+def append_single_beta_result(multi_beta_result, beta, result):
+    r"""Appends the result of one beta to a multi_beta_result dictionary.
+
+    Keys present on one side only (e.g. results written by an older version of the code) are
+    padded with None, so that every list keeps the length of multi_beta_result["betas"].
+    """
+    num_old_betas = len(multi_beta_result["betas"])
+    multi_beta_result["betas"].append(beta)
+    for key in result.keys():
+        if key not in multi_beta_result:
+            multi_beta_result[key] = [None for _ in range(num_old_betas)]
+        multi_beta_result[key].append(result[key])
+    for key in multi_beta_result.keys():
+        if key not in result and key not in ["betas", "optimization_options", "backend"]:
+            multi_beta_result[key].append(None)
 
 
 class MHETS_instance:
@@ -39,11 +66,16 @@ class MHETS_instance:
         flag="statevector",
         backend=None,
         initial_parameter_list=None,
+        recorder_options=None,
+        estimator=None,
+        cache_options=None,
+        seed=None,
     ):
         self.H = H
         self.N = H.N
-        self.gy = H.gy
-        self.B = H.B
+        # General spin models (see operator_creation.spin_hamiltonian) have no gy, B
+        self.gy = getattr(H, "gy", None)
+        self.B = getattr(H, "B", None)
         self.ancilla_ansatz = ancilla_ansatz
         self.N_ancilla = ancilla_ansatz.num_qubits
         self.system_ansatz = system_ansatz
@@ -53,8 +85,8 @@ class MHETS_instance:
         if self.N != self.N_system:
             print("Warning!!! N Hamiltonian != N system ansatz")
         if ancilla_ansatz.get_par_name() == system_ansatz.get_par_name():
-            self.system_ansatz.par_name = "{}{}".format(
-                system_ansatz.get_par_name(), system_ansatz.get_par_name()
+            self.system_ansatz.set_par_name(
+                "{}{}".format(system_ansatz.get_par_name(), system_ansatz.get_par_name())
             )
             print(
                 "Changed system_ansatz parameters name to {}".format(
@@ -78,7 +110,51 @@ class MHETS_instance:
         self.current_parameter_list = self.initial_parameter_list.copy()
         self.flag = flag
         self.backend = backend
+        # "tomography" (StateTomography of the total circuit), "measurement" (Z on the
+        # ancilla, qubit-wise commuting groups of H on the system) or "shadow" (classical
+        # shadows, snapshots kept by the recorder), used with a backend.
+        # estimator, recorder_options, cache_options and seed not given are taken from
+        # optimization_options, and the values in use are written back in It, so that
+        # saved results and rebuilt instances (see parallel.build_instance) know them
         self.optimization_options = optimization_options
+        if estimator is None:
+            estimator = self.optimization_options.get("estimator", "tomography")
+        if recorder_options is None:
+            recorder_options = self.optimization_options.get("recorder_options", {})
+        if cache_options is None:
+            cache_options = self.optimization_options.get("cache_options", None)
+        if seed is None:
+            seed = self.optimization_options.get("seed", None)
+        self.estimator = estimator
+        # Options of the cost_recorder made for each optimization (size, decimation, ...)
+        self.recorder_options = recorder_options
+        self.recorder = None
+        # Archive of the evaluations shared by all the betas, None (off) unless a driver
+        # that uses it (e.g. multi_beta_optimization_archive) turns it on
+        self.archive = None
+        # LRU cache of the evaluations (see cost_cache), {"size": 0} turns it off. It is on
+        # by default only in statevector mode, where evaluations are exact: with sampled
+        # estimators a hit would return the first estimate of that point instead of an
+        # independent resample (which SPSA calibration needs), so there It is opt-in
+        if cache_options is None:
+            cache_options = {} if self.backend is None and self.N_ancilla == self.N else {"size": 0}
+        self.cost_cache = cost_cache(**cache_options)
+        self.optimization_options["estimator"] = self.estimator
+        self.optimization_options["recorder_options"] = self.recorder_options
+        self.optimization_options["cache_options"] = cache_options
+        # Random generator of the initial parameter perturbation (see optimize)
+        self.seed = seed
+        self.rng = np.random.default_rng(self.seed)
+        self.optimization_options["seed"] = self.seed
+        # Gate structure of the ansatzes for the NumPy statevector simulation
+        self.ancilla_operations = numpy_simulator.ansatz_operations(self.ancilla_ansatz)
+        self.system_operations = numpy_simulator.ansatz_operations(self.system_ansatz)
+        self.total_template = None
+        self.measurement_circuits = None
+        self.shadow_circuits = None
+        self.tomography_circuits = None
+        # Parity-preserving system ansatz and H: U_S|k> is simulated in the sector of k
+        self.parity_sectors = self.system_ansatz.preserves_parity() and self.H.conserves_parity()
 
     def get_N(self):
         return self.N
@@ -89,18 +165,54 @@ class MHETS_instance:
     def get_current_parameters(self):
         return self.current_parameter_list
 
-    def build_total_circuit(self):
-        ancilla_qc = self.ancilla_ansatz.build()
-        system_qc = self.system_ansatz.build()
-        total_qc = QuantumCircuit(self.N_ancilla + self.N)
-        total_qc.append(ancilla_qc, range(0, self.N_ancilla))
-        for qbit in range(0, self.N):
-            total_qc.cx(qbit, qbit + self.N_ancilla)
-        total_qc.append(system_qc, range(self.N_ancilla, self.N_ancilla + self.N))
-        return total_qc
+    def get_total_parameters(self):
+        return list(self.ancilla_ansatz.get_parameters()) + list(
+            self.system_ansatz.get_parameters()
+        )
+
+    def get_total_template(self):
+        r"""Returns the parameterized total circuit, composed from the cached ansatz templates only once."""
+        if self.total_template is None:
+            total_qc = QuantumCircuit(self.N_ancilla + self.N)
+            total_qc.compose(
+                self.ancilla_ansatz.get_template(), range(0, self.N_ancilla), inplace=True
+            )
+            for qbit in range(0, self.N):
+                total_qc.cx(qbit, qbit + self.N_ancilla)
+            total_qc.compose(
+                self.system_ansatz.get_template(),
+                range(self.N_ancilla, self.N_ancilla + self.N),
+                inplace=True,
+            )
+            self.total_template = total_qc
+        return self.total_template
+
+    def total_parameter_binds(self, parameter_matrix):
+        r"""Returns the values of the total template for a batch of parameter vectors (k, p) as
+        {Parameter: list of k values} (see ansatz_creation.run_parameter_binds)."""
+        parameter_matrix = np.atleast_2d(np.asarray(parameter_matrix, dtype=float))
+        N_ancilla_parameters = self.ancilla_ansatz.get_num_parameters()
+        parameter_binds = self.ancilla_ansatz.parameter_binds(
+            parameter_matrix[:, :N_ancilla_parameters]
+        )
+        parameter_binds.update(
+            self.system_ansatz.parameter_binds(parameter_matrix[:, N_ancilla_parameters:])
+        )
+        return parameter_binds
+
+    def build_total_circuit(self, parameter_list: list = None):
+        r"""Returns the total circuit with parameter_list assigned (default: current parameters)."""
+        if parameter_list is None:
+            parameter_list = self.current_parameter_list
+        # strict=False: pma leaves some Parameters unused
+        return self.get_total_template().assign_parameters(
+            dict(zip(self.get_total_parameters(), parameter_list)),
+            flat_input=True,
+            strict=False,
+        )
 
     def draw_total_circuit(self):
-        print(self.build_total_circuit().decompose().draw())
+        print(self.build_total_circuit().draw())
         return
 
     def update_parameters(self, parameter_list: list):
@@ -138,20 +250,361 @@ class MHETS_instance:
 
             return data
 
-    def cost_function(self, parameter_list: list, beta, shots):
+    def get_tomography_circuits(self):
+        r"""Returns the StateTomography experiment of the total template and Its parameterized
+        circuits, transpiled only once per backend."""
+        if self.tomography_circuits is None or self.tomography_circuits[0] is not self.backend:
+            # target=None: the target state depends on the parameters, given at each analysis
+            experiment = StateTomography(self.get_total_template(), target=None)
+            self.tomography_circuits = (
+                self.backend,
+                experiment,
+                transpile(experiment.circuits(), self.backend),
+            )
+        return self.tomography_circuits[1], self.tomography_circuits[2]
+
+    def tomography_estimate(self, parameter_list: list, shots):
+        r"""State tomography of the total circuit on the backend, binding parameter_list to the
+        cached transpiled tomography circuits.
+
+        Returns:
+            ExperimentData with the analysis results ("state", "state_fidelity"), as QST.
+        """
+        experiment, circuits = self.get_tomography_circuits()
+        job_result = run_parameter_binds(
+            circuits, self.backend, shots, parameter_binds=self.total_parameter_binds(parameter_list)
+        )
+        data = ExperimentData(experiment=experiment)
+        data.add_data(
+            [
+                {
+                    "counts": job_result.get_counts(index),
+                    "metadata": circuit.metadata,
+                    "shots": shots,
+                    "meas_level": 2,
+                }
+                for index, circuit in enumerate(circuits)
+            ]
+        )
+        return experiment.analysis.run(
+            data, target=Statevector(self.build_total_circuit(parameter_list))
+        ).block_for_results()
+
+    def get_measurement_circuits(self):
+        r"""Returns the parameterized measurement circuits of the measurement estimator (one per
+        qubit-wise commuting group of H), transpiled only once per backend."""
+        if self.measurement_circuits is None or self.measurement_circuits[0] is not self.backend:
+            circuits = pauli_grouping.measurement_circuits(
+                self.get_total_template(),
+                self.H.get_measurement_groups(),
+                qubits=range(self.N_ancilla, self.N_ancilla + self.N),
+            )
+            self.measurement_circuits = (self.backend, transpile(circuits, self.backend))
+        return self.measurement_circuits[1]
+
+    def run_measurement_circuits(self, parameter_matrix, shots):
+        r"""Runs all the measurement circuits for all the parameter vectors in a single job.
+
+        Returns:
+            Job result, the counts of group g and point j have index g * len(parameter_matrix) + j.
+        """
+        return run_parameter_binds(
+            self.get_measurement_circuits(),
+            self.backend,
+            shots,
+            parameter_binds=self.total_parameter_binds(parameter_matrix),
+        )
+
+    def measurement_estimate_batch(self, parameter_matrix, shots):
+        r"""Estimates energy and entropy from direct measurements on the backend, for a batch of
+        parameter vectors (k, p) in a single job.
+
+        One circuit per qubit-wise commuting group of H: the system register is rotated in
+        the group eigenbasis, the ancilla register is measured in Z in all of them.
+
+        Returns:
+            Arrays of length k of energies, entropies and the variances of their estimates.
+        """
+        parameter_matrix = np.atleast_2d(np.asarray(parameter_matrix, dtype=float))
+        num_points = len(parameter_matrix)
+        groups = self.H.get_measurement_groups()
+        job_result = self.run_measurement_circuits(parameter_matrix, shots)
+        energy = np.zeros(num_points)
+        energy_variance = np.zeros(num_points)
+        entropy = np.zeros(num_points)
+        entropy_variance = np.zeros(num_points)
+        for point_index in range(num_points):
+            ancilla_counts = np.zeros(2 ** self.N_ancilla)
+            for group_index, group in enumerate(groups):
+                outcomes, frequencies = measurement_estimation.counts_to_arrays(
+                    job_result.get_counts(group_index * num_points + point_index)
+                )
+                group_energy, group_variance = measurement_estimation.group_expectation_estimate(
+                    group, outcomes, frequencies, self.N, offset=self.N_ancilla
+                )
+                energy[point_index] += group_energy
+                energy_variance[point_index] += group_variance
+                ancilla_counts += np.sum(frequencies) * measurement_estimation.population_estimate(
+                    outcomes, frequencies, self.N_ancilla
+                )
+            (
+                entropy[point_index],
+                entropy_variance[point_index],
+            ) = measurement_estimation.entropy_estimate(
+                ancilla_counts / np.sum(ancilla_counts), np.sum(ancilla_counts)
+            )
+        return energy, entropy, energy_variance, entropy_variance
+
+    def measurement_estimate(self, parameter_list: list, shots):
+        r"""Single-point version of measurement_estimate_batch.
+
+        Returns:
+            Energy, entropy and the variances of their estimates.
+        """
+        self.update_parameters(parameter_list)
+        estimates = self.measurement_estimate_batch([parameter_list], shots)
+        return tuple(estimate[0] for estimate in estimates)
+
+    def shadow_estimate(self, parameter_list: list, shots):
+        r"""Estimates energy and entropy from a classical shadow of the total circuit.
+
+        Returns:
+            Energy, entropy, variance of the energy and the snapshots (see shadows).
+        """
         self.update_parameters(parameter_list)
+        # The measured circuits of the template are transpiled once per backend and basis
+        if self.shadow_circuits is None or self.shadow_circuits[0] is not self.backend:
+            self.shadow_circuits = (self.backend, {})
+        snapshots = shadows.collect_snapshots(
+            self.get_total_template(),
+            self.backend,
+            shots,
+            circuit_cache=self.shadow_circuits[1],
+            parameter_binds=self.total_parameter_binds(parameter_list),
+        )
+        energy, energy_variance = shadows.pauli_estimate(
+            snapshots, self.H.get_pauli(), qubits=range(self.N_ancilla, self.N_ancilla + self.N)
+        )
+        populations = shadows.project_populations(
+            shadows.population_estimate(snapshots, qubits=range(self.N_ancilla))
+        )
+        entropy = measurement_estimation.entropy_estimate(populations, shots)[0]
+        return energy, entropy, energy_variance, snapshots
+
+    def get_system_populations(self, parameter_list: list):
+        r"""Statevector simulation of the two registers without the 2N-qubit density matrix.
 
-        global callback_data
-        global counter
+        The CNOT layer copies the ancilla computational basis on the system, so
+        :math:`\rho_S = \sum_k p_k U_S|k\rangle\langle k|U_S^{\dagger}`, with :math:`p_k` the
+        ancilla populations. Only N-qubit statevectors are needed, simulated with numpy_simulator.
 
-        total_qc = self.build_total_circuit()
+        Returns:
+            Ancilla probabilities, indices k with nonzero :math:`p_k` and the columns
+            :math:`U_S|k\rangle` for those k.
+        """
+        self.update_parameters(parameter_list)
+        parameter_list = np.asarray(parameter_list, dtype=float)
+        N_ancilla_parameters = self.ancilla_ansatz.get_num_parameters()
+        ancilla_state = numpy_simulator.simulate(
+            self.ancilla_operations,
+            self.N_ancilla,
+            numpy_simulator.operation_angles(
+                self.ancilla_operations, parameter_list[:N_ancilla_parameters]
+            ),
+        )[0]
+        prob_ancilla = np.abs(ancilla_state) ** 2
+        basis_states = np.flatnonzero(prob_ancilla)
+        # All the U_S|k> in one batch, as columns
+        system_states = numpy_simulator.simulate(
+            self.system_operations,
+            self.N,
+            numpy_simulator.operation_angles(
+                self.system_operations, parameter_list[N_ancilla_parameters:]
+            ),
+            initial_states=numpy_simulator.basis_states(basis_states, self.N),
+        ).T
+        return prob_ancilla, basis_states, system_states
+
+    def system_energies(self, system_angles, basis_states):
+        r"""Returns :math:`e_k = \langle k|U_S^{\dagger} H U_S|k\rangle` for each row of system angles
+        (see numpy_simulator.operation_angles) and each k in basis_states, shape (rows, len(basis_states)).
+
+        With parity_sectors, each :math:`|k\rangle` is simulated in Its own
+        :math:`2^{N-1}`-dimensional sector and the energy uses the sector block of H.
+        """
+        system_angles = np.atleast_2d(system_angles)
+        energies = np.zeros((len(system_angles), len(basis_states)))
+        if self.parity_sectors:
+            sectors = self.H.get_parity_indices()
+            blocks = self.H.get_parity_blocks()
+        else:
+            sectors = {1: np.arange(2 ** self.N)}
+            blocks = {1: self.H.get_sparse_matrix()}
+        for sector, indices in sectors.items():
+            in_sector = np.isin(basis_states, indices)
+            if not np.any(in_sector):
+                continue
+            positions = np.searchsorted(indices, basis_states[in_sector])
+            initial_states = np.zeros((len(positions), len(indices)))
+            initial_states[np.arange(len(positions)), positions] = 1.0
+            # Every row of angles on every |k>, in one batch
+            angles = np.repeat(system_angles, len(positions), axis=0)
+            initial_states = np.tile(initial_states, (len(system_angles), 1))
+            if self.parity_sectors:
+                states = numpy_simulator.simulate_sector(
+                    self.system_operations, self.N, angles, sector, initial_states
+                )
+            else:
+                states = numpy_simulator.simulate(
+                    self.system_operations, self.N, angles, initial_states
+                )
+            sector_energies = np.real(np.sum(states.conj() * (blocks[sector] @ states.T).T, axis=1))
+            energies[:, in_sector] = sector_energies.reshape(len(system_angles), len(positions))
+        return energies
+
+    def energy_entropy_batch(self, parameter_matrix):
+        r"""Returns the system energies and the ancilla entropies of a batch of parameter
+        vectors, shape (k, p), with the statevector path.
+
+        The k ancilla states are simulated as one stack, then every system unitary is applied
+        to every :math:`|k\rangle` populated by at least one of the candidates, in one batch.
+
+        Returns:
+            Arrays of the k energies and entropies.
+        """
+        parameter_matrix = np.atleast_2d(np.asarray(parameter_matrix, dtype=float))
+        N_ancilla_parameters = self.ancilla_ansatz.get_num_parameters()
+        ancilla_states = numpy_simulator.simulate(
+            self.ancilla_operations,
+            self.N_ancilla,
+            numpy_simulator.operation_angles(
+                self.ancilla_operations, parameter_matrix[:, :N_ancilla_parameters]
+            ),
+        )
+        prob_ancilla = np.abs(ancilla_states) ** 2
+        basis_states = np.flatnonzero(np.any(prob_ancilla > 0.0, axis=0))
+        energies = self.system_energies(
+            numpy_simulator.operation_angles(
+                self.system_operations, parameter_matrix[:, N_ancilla_parameters:]
+            ),
+            basis_states,
+        )
+        populations = prob_ancilla[:, basis_states]
+        log_populations = np.log(np.where(populations > 0.0, populations, 1.0))
+        energy = np.sum(populations * energies, axis=1)
+        entropy = -np.sum(populations * log_populations, axis=1)
+        return energy, entropy
+
+    def energy_entropy(self, parameter_list: list):
+        r"""Returns the system energy and the ancilla entropy with the reduced-cost statevector path."""
+        self.update_parameters(parameter_list)
+        energies, entropies = self.energy_entropy_batch(parameter_list)
+        return energies[0], entropies[0]
+
+    def cost_gradient(self, parameter_list: list, beta, shots=None):
+        r"""Analytic gradient of the cost function with the parameter-shift rule (statevector only).
+
+        With :math:`F = \beta \sum_k p_k e_k + \sum_k p_k \log p_k` and
+        :math:`e_k = \langle k|U_S^{\dagger} H U_S|k\rangle`, the ancilla parameters only move
+        the populations, :math:`\partial F = \sum_k \partial p_k (\beta e_k + \log p_k)`, and
+        the system parameters only move the energies,
+        :math:`\partial F = \beta \sum_k p_k \partial e_k`. Populations equal to zero have zero
+        derivative. All the shifted states are simulated in two batches.
+
+        Returns:
+            Gradient, same shape of parameter_list.
+        """
+        parameter_list = np.asarray(parameter_list, dtype=float)
+        N_ancilla_parameters = self.ancilla_ansatz.get_num_parameters()
+        ancilla_angles = numpy_simulator.operation_angles(
+            self.ancilla_operations, parameter_list[:N_ancilla_parameters]
+        )
+        system_angles = numpy_simulator.operation_angles(
+            self.system_operations, parameter_list[N_ancilla_parameters:]
+        )
+        prob_ancilla = (
+            np.abs(numpy_simulator.simulate(self.ancilla_operations, self.N_ancilla, ancilla_angles)[0])
+            ** 2
+        )
+        basis_states = np.flatnonzero(prob_ancilla)
+        populations = prob_ancilla[basis_states]
+        energies = self.system_energies(system_angles, basis_states)[0]
+        # Ancilla: populations at the shifted angles, all in one batch
+        shifted_ancilla_states = numpy_simulator.simulate(
+            self.ancilla_operations,
+            self.N_ancilla,
+            numpy_simulator.shifted_angles(ancilla_angles),
+        )
+        shifted_populations = np.abs(shifted_ancilla_states[:, basis_states]) ** 2
+        ancilla_gradient = numpy_simulator.parameter_shift_gradient(
+            self.ancilla_operations,
+            shifted_populations @ (beta * energies + np.log(populations)),
+            N_ancilla_parameters,
+        )
+        # System: every shifted U_S on every |k> with p_k > 0, all in one batch
+        shifted_energies = self.system_energies(
+            numpy_simulator.shifted_angles(system_angles), basis_states
+        )
+        system_gradient = numpy_simulator.parameter_shift_gradient(
+            self.system_operations,
+            beta * shifted_energies @ populations,
+            self.system_ansatz.get_num_parameters(),
+        )
+        return np.concatenate([ancilla_gradient, system_gradient])
+
+    def get_system_state(self, parameter_list: list = None):
+        r"""Returns :math:`\rho_S` as DensityMatrix, built from the reduced-cost statevector path."""
+        if parameter_list is None:
+            parameter_list = self.current_parameter_list
+        prob_ancilla, basis_states, system_states = self.get_system_populations(parameter_list)
+        rho_S = (system_states * prob_ancilla[basis_states]) @ system_states.conj().T
+        return DensityMatrix(rho_S)
+
+    def estimate_energy_entropy(self, parameter_list: list, shots):
+        r"""Estimates the system energy and the ancilla entropy with the path of the instance:
+        statevector, measurement or shadow estimator, or state tomography.
+
+        Returns:
+            Energy, entropy and dictionary of the other quantities for the recorder
+            (variances, fidelity, heavy data).
+        """
+        if self.backend is None and self.N_ancilla == self.N:
+            system_exp_value, entropy = self.energy_entropy(parameter_list)
+            return system_exp_value, entropy, {}
+
+        if self.estimator == "measurement" and self.backend is not None:
+            (
+                system_exp_value,
+                entropy,
+                energy_variance,
+                entropy_variance,
+            ) = self.measurement_estimate(parameter_list, shots)
+            return (
+                system_exp_value,
+                entropy,
+                {"energy_variance": energy_variance, "entropy_variance": entropy_variance},
+            )
+
+        if self.estimator == "shadow" and self.backend is not None:
+            system_exp_value, entropy, energy_variance, snapshots = self.shadow_estimate(
+                parameter_list, shots
+            )
+            return (
+                system_exp_value,
+                entropy,
+                {"energy_variance": energy_variance, "heavy": snapshots},
+            )
+
+        self.update_parameters(parameter_list)
+        fidelity = np.nan
+        data = None
         if self.backend is not None:
-            data = self.QST(circuit=total_qc, shots=shots)
+            # The tomography circuits of the template are transpiled once per backend
+            data = self.tomography_estimate(parameter_list, shots)
             rho = data.analysis_results("state").value
-            if counter % 10 == 0:  # Data is heavy, we have to take few
-                callback_data.append([counter, data])
+            fidelity = data.analysis_results("state_fidelity").value
         else:
-            rho = self.QST(circuit=total_qc, shots=shots)
+            rho = self.QST(circuit=self.build_total_circuit(), shots=shots)
         prob_ancilla = rho.probabilities(range(0, self.N_ancilla))
 
         entropy = 0.0
@@ -168,13 +621,124 @@ class MHETS_instance:
 
         # if np.imag(system_exp_value) != 0.0:
         #     print("Warning!!! Exp_value Imag = ", np.imag(system_exp_value))
-        # print("Current F =", np.real(beta * system_exp_value - entropy))
-        if self.flag == "statevector":
-            callback_data.append(
-                [counter, np.real(beta * system_exp_value - entropy)]
-            )  # MemoryError for N=4, maxiter about 2-3000 If you want entire rho
-        counter += 1
-        return np.real(beta * system_exp_value - entropy)
+        # Data is heavy, the recorder keeps few of them in a bounded buffer
+        return np.real(system_exp_value), entropy, {"fidelity": fidelity, "heavy": data}
+
+    def cache_key(self, parameter_list: list, beta, shots):
+        r"""Key of cost_cache. In statevector mode energy and entropy are exact and do not
+        depend on beta and shots, so one entry is valid for every beta."""
+        if self.backend is None and self.N_ancilla == self.N:
+            return self.cost_cache.key(parameter_list)
+        return self.cost_cache.key(parameter_list, beta, shots)
+
+    def cached_energy_entropy(self, parameter_list: list, beta, shots):
+        r"""Returns energy, entropy and the quantities for the recorder as
+        estimate_energy_entropy, from cost_cache when possible.
+
+        New evaluations go in cost_cache. Every evaluation, cached or not, goes in the
+        archive (if any), which may have been turned on after the point was cached. On a hit
+        the quantities for the recorder are empty, since they were recorded the first time.
+        """
+        key = self.cache_key(parameter_list, beta, shots)
+        cached = self.cost_cache.get(key)
+        if cached is not None:
+            self.update_parameters(parameter_list)
+            system_exp_value, entropy = cached
+            record_data = {}
+        else:
+            system_exp_value, entropy, record_data = self.estimate_energy_entropy(
+                parameter_list, shots
+            )
+            self.cost_cache.put(key, (system_exp_value, entropy))
+        if self.archive is not None:
+            self.archive.add(parameter_list, system_exp_value, entropy)
+        return system_exp_value, entropy, record_data
+
+    def cost_function(self, parameter_list: list, beta, shots):
+        if self.recorder is None:
+            self.recorder = cost_recorder(**self.recorder_options)
+        system_exp_value, entropy, record_data = self.cached_energy_entropy(
+            parameter_list, beta, shots
+        )
+        self.recorder.record(
+            beta * system_exp_value - entropy,
+            energy=system_exp_value,
+            entropy=entropy,
+            **record_data,
+        )
+        return beta * system_exp_value - entropy
+
+    def cost_function_all_betas(self, parameter_list: list, betas, shots):
+        r"""Cost function for every beta of betas from a single evaluation, since energy and
+        entropy do not depend on beta. The evaluation goes in the archive (if any), not in
+        the recorder of the current optimization.
+
+        Returns:
+            Array of :math:`\beta E - S`, same length of betas.
+        """
+        system_exp_value, entropy, _ = self.cached_energy_entropy(parameter_list, None, shots)
+        return np.asarray(betas, dtype=float) * system_exp_value - entropy
+
+    def cost_function_batch(self, parameter_matrix, beta, shots):
+        r"""Cost function for a batch of parameter vectors, shape (k, p).
+
+        In statevector mode all the points are simulated as one stack (see
+        energy_entropy_batch), with the measurement estimator on a backend all the points go
+        in a single job, otherwise the points are evaluated one by one. Points already in
+        cost_cache are not evaluated again.
+
+        Returns:
+            Array of the k costs.
+        """
+        parameter_matrix = np.atleast_2d(np.asarray(parameter_matrix, dtype=float))
+        if self.recorder is None:
+            self.recorder = cost_recorder(**self.recorder_options)
+        statevector = self.backend is None and self.N_ancilla == self.N
+        if statevector or (self.estimator == "measurement" and self.backend is not None):
+            energies = np.zeros(len(parameter_matrix))
+            entropies = np.zeros(len(parameter_matrix))
+            energy_variances = np.full(len(parameter_matrix), np.nan)
+            entropy_variances = np.full(len(parameter_matrix), np.nan)
+            keys = [
+                self.cache_key(parameter_list, beta, shots) for parameter_list in parameter_matrix
+            ]
+            missing = []
+            for index, key in enumerate(keys):
+                cached = self.cost_cache.get(key)
+                if cached is None:
+                    missing.append(index)
+                else:
+                    energies[index], entropies[index] = cached
+            if len(missing) > 0:
+                if statevector:
+                    (
+                        energies[missing],
+                        entropies[missing],
+                    ) = self.energy_entropy_batch(parameter_matrix[missing])
+                else:
+                    (
+                        energies[missing],
+                        entropies[missing],
+                        energy_variances[missing],
+                        entropy_variances[missing],
+                    ) = self.measurement_estimate_batch(parameter_matrix[missing], shots)
+                for index in missing:
+                    self.cost_cache.put(keys[index], (energies[index], entropies[index]))
+            if self.archive is not None:
+                self.archive.add_batch(parameter_matrix, energies, entropies)
+            for index in range(len(parameter_matrix)):
+                self.recorder.record(
+                    beta * energies[index] - entropies[index],
+                    energy=energies[index],
+                    entropy=entropies[index],
+                    energy_variance=energy_variances[index],
+                    entropy_variance=entropy_variances[index],
+                )
+            self.current_parameter_list = parameter_matrix[-1]
+            return beta * energies - entropies
+        return np.array(
+            [self.cost_function(parameter_list, beta, shots) for parameter_list in parameter_matrix]
+        )
 
     def optimize(
         self,
@@ -185,78 +749,124 @@ class MHETS_instance:
         tol=1e-1,
         shots=1024,
     ):
-        global counter
-        global callback_data
-        callback_data = []
-        counter = 0
-        total_start = time.time()
-        if initial_parameter_list_guess is None:
-            if optimizer == "spsa":
-                scipy_result = SPSA_lib.spsa_optimization(
-                    cost=self.cost_function,
-                    parameters=self.initial_parameter_list,
-                    args=(beta, shots),
-                    maxiter=maxiter,
-                )
+        self.recorder = cost_recorder(**self.recorder_options)
+        jac = None
+        if optimizer.lower() in GRADIENT_OPTIMIZERS:
+            if self.backend is None and self.N_ancilla == self.N:
+                jac = self.cost_gradient
             else:
-                scipy_result = minimize(
-                    self.cost_function,
-                    self.initial_parameter_list,
-                    args=(beta, shots),
-                    method=optimizer,
-                    options={"maxiter": maxiter},
-                    tol=tol,
+                print(
+                    "Warning!!! Analytic gradient only in statevector mode, "
+                    "{} uses finite differences".format(optimizer)
                 )
-        else:
-            if optimizer == "spsa":
-                scipy_result = SPSA_lib.spsa_optimization(
-                    cost=self.cost_function,
-                    parameters=initial_parameter_list_guess,
-                    args=(beta, shots),
-                    maxiter=maxiter,
+        if initial_parameter_list_guess is None:
+            initial_parameter_list_guess = self.initial_parameter_list
+        if jac is not None:
+            # A pure ancilla state (e.g. the default all-zero parameters) is a stationary
+            # point of the ancilla parameters: the gradient there is exactly zero and a
+            # gradient optimizer would stop at once, so the ancilla part is perturbed
+            N_ancilla_parameters = self.ancilla_ansatz.get_num_parameters()
+            if np.allclose(jac(initial_parameter_list_guess, beta)[:N_ancilla_parameters], 0.0):
+                print(
+                    "Warning!!! Zero ancilla gradient at the initial parameters, "
+                    "ancilla parameters perturbed"
                 )
-            else:
-                scipy_result = minimize(
-                    self.cost_function,
-                    initial_parameter_list_guess,
-                    args=(beta, shots),
-                    method=optimizer,
-                    options={"maxiter": maxiter},
-                    tol=tol,
+                initial_parameter_list_guess = np.array(initial_parameter_list_guess, dtype=float)
+                initial_parameter_list_guess[:N_ancilla_parameters] += self.rng.uniform(
+                    -0.1, 0.1, N_ancilla_parameters
                 )
+        cache_hits = self.cost_cache.hits
+        total_start = time.time()
+        if optimizer == "spsa":
+            scipy_result = SPSA_lib.spsa_optimization(
+                cost=self.cost_function,
+                batch_cost=self.cost_function_batch,
+                parameters=initial_parameter_list_guess,
+                args=(beta, shots),
+                maxiter=maxiter,
+            )
+        elif optimizer == "differential_evolution":
+            # The whole population of each generation is a single batch, shape (p, k) in scipy
+            scipy_result = differential_evolution(
+                lambda population, beta, shots: self.cost_function_batch(population.T, beta, shots),
+                bounds=[(-np.pi, np.pi)] * len(initial_parameter_list_guess),
+                args=(beta, shots),
+                maxiter=maxiter,
+                tol=tol,
+                x0=np.clip(initial_parameter_list_guess, -np.pi, np.pi),
+                polish=False,
+                updating="deferred",
+                vectorized=True,
+            )
+        else:
+            scipy_result = minimize(
+                self.cost_function,
+                initial_parameter_list_guess,
+                args=(beta, shots),
+                method=optimizer,
+                jac=jac,
+                options={"maxiter": maxiter},
+                tol=tol,
+            )
         print("Total time", time.time() - total_start)
+        # Convergence check against the exact minimum -log Z(beta), only if H is already
+        # diagonalized (e.g. attached reference data): it is not worth a diagonalization
+        if getattr(self.H, "parity_spectrum", None) is not None:
+            print("Gap from exact Helmoltz energy", scipy_result.fun - self.H.cost_function(beta))
 
         result = {
             "optimized_parameter_list": scipy_result.x,
             "Helmoltz energy": scipy_result.fun,
             "Time optimization": time.time() - total_start,
-            "n_eval": scipy_result.nfev,
-            "callback_data": callback_data,
+            # With vectorized=True scipy counts the calls, the recorder counts the candidates
+            "n_eval": self.recorder.get_counter()
+            if optimizer == "differential_evolution"
+            else scipy_result.nfev,
+            "n_grad": getattr(scipy_result, "njev", None),
+            # Per beta, since results of different estimators can end up in the same data
+            "estimator": self.estimator,
+            "callback_data": self.recorder.get_data(),
+            "n_cache_hits": self.cost_cache.hits - cache_hits,
         }
         return result
 
-    def multi_beta_optimization_from_scratch(self, betas):
-        # INITIALIZE THE DICTIONARY RESULT
+    def optimize_stored(self, beta, initial_parameter_list_guess=None, store=None):
+        r"""Optimizes beta with the optimization options of the instance, unless beta is already
+        complete in store (see result_handler.MHETS_store). New results are saved in store."""
+        if store is not None and store.has_beta(beta):
+            print("Beta = {} already complete, loaded from store".format(beta))
+            return store.load(beta)
         result = self.optimize(
-            beta=betas[0],
-            initial_parameter_list_guess=self.optimization_options["initial_parameter_list"][0],
+            beta=beta,
+            initial_parameter_list_guess=initial_parameter_list_guess,
             maxiter=self.optimization_options["maxiter"],
             optimizer=self.optimization_options["optimizer"],
             tol=self.optimization_options["tol"],
             shots=self.optimization_options["shots"],
         )
+        if store is not None:
+            store.save(beta, result)
+        return result
+
+    def multi_beta_optimization_from_scratch(self, betas, store=None):
+        # INITIALIZE THE DICTIONARY RESULT
+        result = self.optimize_stored(
+            betas[0],
+            initial_parameter_list_guess=self.optimization_options["initial_parameter_list"][0],
+            store=store,
+        )
         multi_beta_result = {
-            "betas": [betas[0]],
+            "betas": [],
             "optimization_options": self.optimization_options,
             "backend": self.backend,
         }
-        for key in result.keys():
-            multi_beta_result[key] = [result[key]]
+        # Results loaded from a store may have been written by an older version of the code
+        append_single_beta_result(multi_beta_result, betas[0], result)
         # CONTINUE FILLING IT
         for index in range(1, len(betas)):
             # HERE TO CHANGE INITIAL PARAMETER GUESS WITH PREVIOUS OPTIMIZED PARAMETERS
-            result = self.optimize(
-                beta=betas[index],
+            result = self.optimize_stored(
+                betas[index],
                 initial_parameter_list_guess=self.optimization_options["initial_parameter_list"][
                     index
                 ],  # -> THIS IS STRATEGY A0
@@ -265,59 +875,218 @@ class MHETS_instance:
                 # ][
                 #     index - 1
                 # ],  # THIS IS STRATEGY A1
-                maxiter=self.optimization_options["maxiter"],
-                optimizer=self.optimization_options["optimizer"],
-                tol=self.optimization_options["tol"],
-                shots=self.optimization_options["shots"],
+                store=store,
             )
-            multi_beta_result["betas"].append(betas[index])
-            for key in result.keys():
-                multi_beta_result[key].append(result[key])
+            append_single_beta_result(multi_beta_result, betas[index], result)
         return multi_beta_result
 
-    def multi_beta_optimization_from_data(self, betas, old_data):
+    def multi_beta_optimization_from_data(self, betas, old_data, store=None):
         # INITIALIZE DICTIONARY RESULT
         multi_beta_result = {
+            "betas": [],
             "optimization_options": self.optimization_options,
             "backend": self.backend,
         }
-        for key in old_data.keys():
-            if key != "optimization_options":
-                if key != "backend":
-                    multi_beta_result[key] = []
         # FILLING DICTIONARY RESULT
         for new_beta_index in range(len(betas)):
             if betas[new_beta_index] in old_data["betas"]:
                 old_beta_index = old_data["betas"].index(betas[new_beta_index])
-                for key in old_data.keys():
-                    if key != "optimization_options":
-                        if key != "backend":
-                            multi_beta_result[key].append(old_data[key][old_beta_index])
+                # old_data may have been written by an older version of the code, with less
+                # keys: append_single_beta_result pads them with None at the right index
+                old_result = {
+                    key: old_data[key][old_beta_index]
+                    for key in old_data.keys()
+                    if key not in ["betas", "optimization_options", "backend"]
+                }
+                append_single_beta_result(multi_beta_result, betas[new_beta_index], old_result)
             else:
                 # TODO: check initial parameters when flag=hardware, not implemented
-                result = self.optimize(
-                    beta=betas[new_beta_index],
+                result = self.optimize_stored(
+                    betas[new_beta_index],
                     # initial_parameter_list_guess=self.optimization_options[
                     #     "initial_parameter_list"
                     # ][new_beta_index], # -> THIS IS STRATEGY A0
                     initial_parameter_list_guess=multi_beta_result["optimized_parameter_list"][
                         new_beta_index - 1
                     ],  # THIS IS STRATEGY A1
-                    maxiter=self.optimization_options["maxiter"],
-                    optimizer=self.optimization_options["optimizer"],
-                    tol=self.optimization_options["tol"],
-                    shots=self.optimization_options["shots"],
+                    store=store,
+                )
+                append_single_beta_result(multi_beta_result, betas[new_beta_index], result)
+        return multi_beta_result
+
+    def multi_beta_optimization_archive(self, betas, archive_size=10000):
+        r"""Optimizes the betas in order, sharing every evaluation across betas.
+
+        All the evaluations go in an evaluation_archive. Each beta after the first starts
+        from the archived point with the lowest :math:`\beta E - S` at that beta, which
+        may come from any earlier beta. After the sweep the archive is scanned again for
+        every beta: "Archive Helmoltz energy" and "archive_parameter_list" are the best
+        archived point at that beta. These can beat the optimized one, e.g. with points
+        found while optimizing a later beta. With sampled estimators the archived minimum
+        is biased low by the shot noise, so it should be re-evaluated before being trusted.
+
+        Returns:
+            multi_beta_result dictionary and the archive data (see evaluation_archive.get_data).
+        """
+        self.archive = evaluation_archive(size=archive_size)
+        multi_beta_result = {
+            "betas": [],
+            "optimization_options": self.optimization_options,
+            "backend": self.backend,
+        }
+        for index in range(len(betas)):
+            initial_parameter_list_guess, _ = self.archive.best(betas[index])
+            if initial_parameter_list_guess is None:
+                initial_parameter_list_guess = self.optimization_options["initial_parameter_list"][
+                    index
+                ]
+            else:
+                initial_parameter_list_guess = initial_parameter_list_guess[0]
+            result = self.optimize(
+                beta=betas[index],
+                initial_parameter_list_guess=initial_parameter_list_guess,
+                maxiter=self.optimization_options["maxiter"],
+                optimizer=self.optimization_options["optimizer"],
+                tol=self.optimization_options["tol"],
+                shots=self.optimization_options["shots"],
+            )
+            append_single_beta_result(multi_beta_result, betas[index], result)
+        multi_beta_result["Archive Helmoltz energy"] = []
+        multi_beta_result["archive_parameter_list"] = []
+        for index in range(len(betas)):
+            parameter_list, free_energy = self.archive.best(betas[index])
+            if parameter_list is None:
+                # Nothing archived (e.g. no evaluation at all): fall back to the optimization
+                multi_beta_result["Archive Helmoltz energy"].append(
+                    multi_beta_result["Helmoltz energy"][index]
+                )
+                multi_beta_result["archive_parameter_list"].append(
+                    multi_beta_result["optimized_parameter_list"][index]
+                )
+            else:
+                multi_beta_result["Archive Helmoltz energy"].append(free_energy[0])
+                multi_beta_result["archive_parameter_list"].append(parameter_list[0])
+        archive_data = self.archive.get_data()
+        self.archive = None
+        return multi_beta_result, archive_data
+
+    def thermal_fidelity(self, parameter_list: list, beta):
+        r"""Fidelity of :math:`\rho_S` (ideal circuit, see get_system_state) with the exact thermal state."""
+        return self.H.thermal_state_metrics(
+            [self.get_system_state(parameter_list)], [beta], metrics=("fidelity",)
+        )["fidelity"][0, 0]
+
+    def multi_beta_optimization_annealing(
+        self,
+        beta_min,
+        beta_max,
+        initial_step=0.1,
+        min_step=0.01,
+        max_step=1.0,
+        parameter_change=0.5,
+        free_energy_tolerance=1e-3,
+        fidelity_drop=0.01,
+    ):
+        r"""Walks beta from beta_min to beta_max, each beta warm-started from the previous optimum
+        (strategy A1), with an adaptive beta step.
+
+        After each accepted beta the next step is the smallest among twice the current step,
+        the step that moves the optimal parameters by about parameter_change (norm of the
+        angle differences, linear extrapolation of the last move), and the step over which
+        the quadratic term of F, estimated from the last three optimal free energies, stays
+        below free_energy_tolerance. The step is clipped to [min_step, max_step].
+        If the fidelity with the exact thermal state drops by more than fidelity_drop
+        with respect to the previous beta, the point is rejected and retried at half the step
+        (midpoint refinement), down to min_step.
+
+        Returns:
+            multi_beta_result dictionary, with the additional keys "Fidelity", "Refinements"
+            (number of rejected attempts before each beta) and "n_eval refinements" (their
+            evaluations).
+        """
+        result = self.optimize(
+            beta=beta_min,
+            initial_parameter_list_guess=self.optimization_options["initial_parameter_list"][0],
+            maxiter=self.optimization_options["maxiter"],
+            optimizer=self.optimization_options["optimizer"],
+            tol=self.optimization_options["tol"],
+            shots=self.optimization_options["shots"],
+        )
+        result["Fidelity"] = self.thermal_fidelity(result["optimized_parameter_list"], beta_min)
+        result["Refinements"] = 0
+        result["n_eval refinements"] = 0
+        multi_beta_result = {
+            "betas": [],
+            "optimization_options": self.optimization_options,
+            "backend": self.backend,
+        }
+        append_single_beta_result(multi_beta_result, beta_min, result)
+        step = initial_step
+        refinements = 0
+        refinement_evaluations = 0
+        while multi_beta_result["betas"][-1] < beta_max:
+            beta = multi_beta_result["betas"][-1]
+            next_beta = min(beta + step, beta_max)
+            result = self.optimize(
+                beta=next_beta,
+                initial_parameter_list_guess=multi_beta_result["optimized_parameter_list"][-1],
+                maxiter=self.optimization_options["maxiter"],
+                optimizer=self.optimization_options["optimizer"],
+                tol=self.optimization_options["tol"],
+                shots=self.optimization_options["shots"],
+            )
+            fidelity = self.thermal_fidelity(result["optimized_parameter_list"], next_beta)
+            if fidelity < multi_beta_result["Fidelity"][-1] - fidelity_drop and step > min_step:
+                print("Fidelity drop at beta = {}, refining the step".format(next_beta))
+                step = max(step / 2.0, min_step)
+                refinements += 1
+                refinement_evaluations += result["n_eval"]
+                continue
+            result["Fidelity"] = fidelity
+            result["Refinements"] = refinements
+            result["n_eval refinements"] = refinement_evaluations
+            refinements = 0
+            refinement_evaluations = 0
+            append_single_beta_result(multi_beta_result, next_beta, result)
+            # Next step
+            h = next_beta - beta
+            steps = [2.0 * h]
+            parameter_move = np.linalg.norm(
+                np.angle(
+                    np.exp(
+                        1j
+                        * (
+                            multi_beta_result["optimized_parameter_list"][-1]
+                            - multi_beta_result["optimized_parameter_list"][-2]
+                        )
+                    )
+                )
+            )
+            if parameter_move > 0.0:
+                steps.append(h * parameter_change / parameter_move)
+            if len(multi_beta_result["betas"]) >= 3:
+                beta_0, beta_1, beta_2 = multi_beta_result["betas"][-3:]
+                F_0, F_1, F_2 = multi_beta_result["Helmoltz energy"][-3:]
+                curvature = (
+                    2.0
+                    * ((F_2 - F_1) / (beta_2 - beta_1) - (F_1 - F_0) / (beta_1 - beta_0))
+                    / (beta_2 - beta_0)
                 )
-                multi_beta_result["betas"].append(betas[new_beta_index])
-                for key in result.keys():
-                    multi_beta_result[key].append(result[key])
+                if curvature != 0.0:
+                    steps.append(np.sqrt(2.0 * free_energy_tolerance / np.abs(curvature)))
+            step = float(np.clip(min(steps), min_step, max_step))
         return multi_beta_result
 
     def multi_beta_optimization_run(
         self,
         betas,
         n_starting_point=10,
+        processes=1,
+        halving_rounds=0,
+        eta=2,
     ):
+        r"""Multi-start optimization for each beta, see montecarlo.run for processes,
+        halving_rounds and eta."""
         # INITIALIZE THE DICTIONARY RESULT
         minimized_result, total_result = montecarlo.run(
             self,
@@ -327,6 +1096,9 @@ class MHETS_instance:
             maxiter=self.optimization_options["maxiter"],
             tol=self.optimization_options["tol"],
             shots=self.optimization_options["shots"],
+            processes=processes,
+            halving_rounds=halving_rounds,
+            eta=eta,
         )
         multi_beta_result = {
             "betas": [betas[0]],
@@ -356,6 +1128,9 @@ class MHETS_instance:
                 maxiter=self.optimization_options["maxiter"],
                 tol=self.optimization_options["tol"],
                 shots=self.optimization_options["shots"],
+                processes=processes,
+                halving_rounds=halving_rounds,
+                eta=eta,
             )
             multi_beta_result["betas"].append(betas[index])
             for key in minimized_result.keys():
@@ -112,8 +112,9 @@ class QMETTS_instance:
     ):
         self.H = H
         self.N = H.N
-        self.gy = H.gy
-        self.B = H.B
+        # General spin models (see operator_creation.spin_hamiltonian) have no gy, B
+        self.gy = getattr(H, "gy", None)
+        self.B = getattr(H, "B", None)
         self.operators = operators
         self.flag = flag
         self.basis_list = lb.generate_basis_list(
@@ -276,22 +277,31 @@ class QMETTS_instance:
             # Pickle the preparation_result dictionary using the highest protocol available.
             pickle.dump(preparation_result, f, pickle.HIGHEST_PROTOCOL)
 
-    def compute_exp_on_basis(self, op, preparation_result):
+    def compute_exp_on_basis(self, op, preparation_result, measure_shots=None):
         r"""Computes the expectation value of the observable op on the evolved statevectors.
 
         Args:
             op: Observable you want to compute the expectation value as SparsePauliOp.
             preparation_result: Dictionary of the basis statevectors results.
+            measure_shots: If not None, expectation values are estimated with this number of
+                shots per qubit-wise commuting group of op (see state_label.sampled_exp_value).
 
         Returns:
             Dictionary of the expectation values with basis statevectors labels as keys.
         """
         preparation_exp_values = {}
         for basis_state in self.basis_list:
-            preparation_exp_values[basis_state] = lb.exp_value(
-                circuit=preparation_result[basis_state]["circuit_list"][-1],
-                observable=op,
-            )
+            if measure_shots is None:
+                preparation_exp_values[basis_state] = lb.exp_value(
+                    circuit=preparation_result[basis_state]["circuit_list"][-1],
+                    observable=op,
+                )
+            else:
+                preparation_exp_values[basis_state] = lb.sampled_exp_value(
+                    circuit=preparation_result[basis_state]["circuit_list"][-1],
+                    observable=op,
+                    shots=measure_shots,
+                )
         return preparation_exp_values
 
     def qmetts(
@@ -336,7 +346,7 @@ class QMETTS_instance:
 
         return result
 
-    def multi_beta_qmetts(self, op, initial_state, shots):
+    def multi_beta_qmetts(self, op, initial_state, shots, measure_shots=None):
         r"""Performs the QMETTS algorithm for all the betas.
 
         For each intermediate beta, It splits the results of the evolved basis statevectors and performs the QMETTS algorithm.
@@ -345,6 +355,7 @@ class QMETTS_instance:
             op: Observable you want to make the thermal average of, as SparsePauliOp.
             initial_state: Label of the initial state you want to start each chain with.
             shots: Length of each chain, i.e. number of times the measure is made.
+            measure_shots: Shots to estimate the expectation values of op (None: exact).
 
         Returns:
             Results of the QMETTS algorithm for all the betas, as QMETTS_result class.
@@ -369,7 +380,9 @@ class QMETTS_instance:
             )
             print("computing exp_value for beta = {}".format(partial_tau * 2))
             temporary_preparation_exp_values = self.compute_exp_on_basis(
-                op=op, preparation_result=temporary_preparation_result
+                op=op,
+                preparation_result=temporary_preparation_result,
+                measure_shots=measure_shots,
             )
             for basis_state in self.basis_list:
                 preparation_exp_values[basis_state] += [
@@ -8,15 +8,36 @@ Created on Wed Apr 10 16:34:31 2024
 
 @author: DeWitt
 """
+import numpy as np
 from qiskit_algorithms.optimizers import SPSA
 
 
 def spsa_optimization(
-    cost, parameters, args, maxiter=300, learning_rate=None, perturbation=None
+    cost,
+    parameters,
+    args,
+    maxiter=300,
+    learning_rate=None,
+    perturbation=None,
+    batch_cost=None,
+    max_evals_grouped=2,
 ):
+    r"""SPSA minimization of cost(parameters, *args).
+
+    If batch_cost(parameter_matrix, *args) is given, SPSA passes up to max_evals_grouped
+    points at once (e.g. the +/- perturbations of an iteration) to It.
+    """
+
     def lambda_cost(cost, args):
         return lambda parameters: cost(parameters, *args)
 
-    spsa = SPSA(maxiter=maxiter, learning_rate=learning_rate, perturbation=perturbation)
+    def lambda_batch_cost(cost, batch_cost, args):
+        return lambda parameters: (
+            batch_cost(parameters, *args) if np.ndim(parameters) == 2 else cost(parameters, *args)
+        )
 
-    return spsa.minimize(fun=lambda_cost(cost, args), x0=parameters)
+    spsa = SPSA(maxiter=maxiter, learning_rate=learning_rate, perturbation=perturbation)
+    if batch_cost is None:
+        return spsa.minimize(fun=lambda_cost(cost, args), x0=parameters)
+    spsa.set_max_evals_grouped(max_evals_grouped)
+    return spsa.minimize(fun=lambda_batch_cost(cost, batch_cost, args), x0=parameters)
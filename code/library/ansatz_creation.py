@@ -10,13 +10,138 @@ Created on Thu Dec  7 15:59:33 2023
 """
 # TODO: Add error raising
 import math
+import numpy as np
 
 
 from qiskit.circuit import QuantumCircuit, Parameter
 from library.gate_creation import RYXGate, RXYGate
 
 
-class two_local:
+def run_parameter_binds(circuits, backend, shots, parameter_binds=None, **run_options):
+    r"""Runs parameterized circuits on backend for k values of Their Parameters in a single job.
+
+    Aer backends bind the values natively with parameter_binds, the others get the circuits
+    with the values assigned.
+
+    Args:
+        circuits: Transpiled circuits.
+        backend: Backend with run(circuits, shots, ...).
+        shots: Shots of each circuit and values.
+        parameter_binds: Dictionary {Parameter: list of k values} (see
+            parameterized_ansatz.parameter_binds), None if the circuits have no Parameters.
+        run_options: Other options of backend.run (e.g. memory=True).
+
+    Returns:
+        Job result, circuit c with the values j has index c * k + j.
+    """
+    if parameter_binds is None:
+        return backend.run(circuits, shots=shots, **run_options).result()
+    if backend.name.startswith("aer"):
+        circuit_binds = []
+        for circuit in circuits:
+            circuit_parameters = set(circuit.parameters)
+            circuit_binds.append(
+                {
+                    parameter: values
+                    for parameter, values in parameter_binds.items()
+                    if parameter in circuit_parameters
+                }
+            )
+        return backend.run(
+            circuits, shots=shots, parameter_binds=circuit_binds, **run_options
+        ).result()
+    num_values = len(next(iter(parameter_binds.values())))
+    bound_circuits = [
+        circuit.assign_parameters(
+            {parameter: values[j] for parameter, values in parameter_binds.items()},
+            flat_input=True,
+            strict=False,
+        )
+        for circuit in circuits
+        for j in range(num_values)
+    ]
+    return backend.run(bound_circuits, shots=shots, **run_options).result()
+
+
+class parameterized_ansatz:
+    r"""Methods shared by the ansatzes: Parameters, cached template and binding of values.
+
+    Subclasses define create_parameters() and build_template() and set num_qubits, num_reps,
+    par_name, par, parameter_values, template and circuit in __init__.
+    """
+
+    def get_circuit(self):
+        return self.circuit
+
+    def get_num_qubits(self):
+        return self.num_qubits
+
+    def get_num_reps(self):
+        return self.num_reps
+
+    def get_par_name(self):
+        return self.par_name
+
+    def get_parameters(self):
+        return self.par
+
+    def get_num_parameters(self):
+        return len(self.par)
+
+    def has_unused_parameters(self):
+        r"""True if some Parameters of par do not appear in the template."""
+        return False
+
+    def set_par_name(self, par_name: str):
+        r"""Changes the parameters name, creating new Parameters and a new template."""
+        self.par_name = par_name
+        self.par = self.create_parameters()
+        self.template = None
+
+    def get_template(self):
+        r"""Returns the parameterized circuit. It is built only once and then cached."""
+        if self.template is None:
+            self.template = self.build_template()
+        return self.template
+
+    def bind_parameters(self, par: list):
+        r"""Stores the parameter values used by build(). The Parameters of the template are untouched."""
+        self.parameter_values = list(par)
+
+    def get_parameter_values(self):
+        return self.parameter_values
+
+    def bound_circuit(self, values: list = None):
+        r"""Returns the template with values assigned (default: the values of bind_parameters)."""
+        if values is None:
+            values = self.parameter_values
+        return self.get_template().assign_parameters(
+            dict(zip(self.par, values)), flat_input=True, strict=not self.has_unused_parameters()
+        )
+
+    def parameter_binds(self, values=None):
+        r"""Returns values in the format of Aer parameter_binds, to bind the template on the backend.
+
+        Args:
+            values: Parameter vector (p,) or batch of parameter vectors (k, p).
+
+        Returns:
+            Dictionary {Parameter: list of k values}.
+        """
+        if values is None:
+            values = self.parameter_values
+        values = np.atleast_2d(values)
+        return {parameter: list(values[:, i]) for i, parameter in enumerate(self.par)}
+
+    def build(self):
+        if self.parameter_values is None:
+            self.circuit = self.get_template()
+        else:
+            self.circuit = self.bound_circuit()
+        return self.circuit
+
+
+class two_local(parameterized_ansatz):
     def __init__(
         self,
         num_qubits: int,
@@ -32,23 +157,22 @@ class two_local:
         self.entanglement = entanglement
         self.num_reps = num_reps
         self.par_name = par_name
-        self.par = [
-            Parameter("{}_{}".format(par_name, i))
+        self.par = self.create_parameters()
+        self.parameter_values = None
+        self.template = None
+        self.circuit = QuantumCircuit(self.num_qubits)
+
+    def create_parameters(self):
+        return [
+            Parameter("{}_{}".format(self.par_name, i))
             for i in range(
                 0, self.num_qubits * len(self.rotation_blocks) * (self.num_reps + 1)
             )
         ]
-        self.circuit = QuantumCircuit(self.num_qubits)
 
     def get_name(self):
         return "two_local"
 
-    def get_circuit(self):
-        return self.circuit
-
-    def get_num_qubits(self):
-        return self.num_qubits
-
     def get_rotation_blocks(self):
         return self.rotation_blocks
 
@@ -58,17 +182,14 @@ class two_local:
     def get_entanglement(self):
         return self.entanglement
 
-    def get_num_reps(self):
-        return self.num_reps
+    def preserves_parity(self):
+        # RX, RY and CX change the parity
+        return False
 
-    def get_par_name(self):
-        return self.par_name
-
-    def get_parameters(self):
-        return self.par
-
-    def get_num_parameters(self):
-        return len(self.par)
+    def has_unused_parameters(self):
+        # Every rotation block of qubit i uses par[i], the other Parameters of the layer
+        # are used only with a single rotation block
+        return len(self.rotation_blocks) > 1
 
     def add_entanglement_layer(self, qc: QuantumCircuit, entanglement: str):
         if entanglement == "linear":
@@ -89,14 +210,11 @@ class two_local:
                 elif gate == "rz":
                     qc.rz(par[i], i)
 
-    def bind_parameters(self, par: list):
-        self.par = par
-
-    def build(self):
-        self.circuit = QuantumCircuit(self.num_qubits)
+    def build_template(self):
+        circuit = QuantumCircuit(self.num_qubits)
         for rep in range(self.num_reps):
             self.add_rotation_layer(
-                self.circuit,
+                circuit,
                 self.rotation_blocks,
                 self.par[
                     self.num_qubits
@@ -106,16 +224,16 @@ class two_local:
                     * (rep + 1)
                 ],
             )
-            self.add_entanglement_layer(self.circuit, self.entanglement)
+            self.add_entanglement_layer(circuit, self.entanglement)
         self.add_rotation_layer(
-            self.circuit,
+            circuit,
             self.rotation_blocks,
             self.par[self.num_qubits * len(self.rotation_blocks) * (self.num_reps) :],
         )
-        return self.circuit
+        return circuit
 
 
-class pma:
+class pma(parameterized_ansatz):
     r"""
         Class to define a Phisically Motivated Ansatz for the LMG model: RP(x_i, x_j) 
         rotation blocks made of 2-qubit gates RP(x_i, x_j) = RXY(x_i)RYX(x_j).
@@ -134,43 +252,39 @@ class pma:
         self.architecture = architecture
         self.num_reps = num_reps
         self.par_name = par_name
+        self.par = self.create_parameters()
+        self.parameter_values = None
+        self.template = None
+        self.circuit = QuantumCircuit(self.num_qubits)
+
+    def create_parameters(self):
         if self.architecture == "full":
-            self.par = [
+            return [
                 Parameter("{}_{}".format(self.par_name, i))
                 for i in range(
                     0, 2 * math.comb(self.num_qubits, 2) * (self.num_reps + 1)
                 )
             ]
         elif self.architecture == "linear":
-            self.par = [
+            return [
                 Parameter("{}_{}".format(self.par_name, i))
                 for i in range(0, 2 * (self.num_qubits - 1) * (self.num_reps + 1))
             ]
-        self.circuit = QuantumCircuit(self.num_qubits)
 
     def get_name(self):
         return "pma"
 
-    def get_circuit(self):
-        return self.circuit
-
-    def get_num_qubits(self):
-        return self.num_qubits
-
     def get_architecture(self):
         return self.architecture
 
-    def get_num_reps(self):
-        return self.num_reps
-
-    def get_par_name(self):
-        return self.par_name
-
-    def get_parameters(self):
-        return self.par
+    def preserves_parity(self):
+        # RXY and RYX commute with the product of Z
+        return True
 
-    def get_num_parameters(self):
-        return len(self.par)
+    def has_unused_parameters(self):
+        # add_layer moves par_counter by 1 for each RXY-RYX pair, so only the first
+        # half (plus one) of the Parameters of a layer is used
+        return True
 
     def add_layer(self, qc: QuantumCircuit, architecture: str, rep: int):
         if architecture == "linear":
@@ -211,11 +325,8 @@ class pma:
                     )
                     par_counter += 1
 
-    def bind_parameters(self, par: list):
-        self.par = par
-
-    def build(self):
-        self.circuit = QuantumCircuit(self.num_qubits)
+    def build_template(self):
+        circuit = QuantumCircuit(self.num_qubits)
         for rep in range(self.num_reps + 1):
-            self.add_layer(qc=self.circuit, architecture=self.architecture, rep=rep)
-        return self.circuit
+            self.add_layer(qc=circuit, architecture=self.architecture, rep=rep)
+        return circuit
@@ -0,0 +1,100 @@
+# -*- coding: utf-8 -*-
+r"""
+Class to archive the (energy, entropy) of the evaluated parameter vectors, shared by all the betas.
+
+Energy and entropy do not depend on beta, so every evaluation made while optimizing one
+beta gives :math:`F(\beta') = \beta' E - S` for any other beta' for free. The archive keeps
+the parameter vectors with Their E and S in preallocated arrays. When full, only the
+points not dominated by another one (lower E and higher S) are kept, since the minimum of
+F for any positive beta is always one of them, plus the most recent ones.
+
+
+
+Created on Mon Oct 19 21:36:04 2026
+
+@author: DeWitt
+"""
+import numpy as np
+
+
+class evaluation_archive:
+    r"""Bounded archive of the cost function evaluations, for all the betas.
+
+    Args:
+        size: Number of preallocated points.
+    """
+
+    def __init__(self, size=10000):
+        self.size = size
+        self.parameters = None
+        self.energies = np.full(self.size, np.nan)
+        self.entropies = np.full(self.size, np.nan)
+        self.length = 0
+
+    def __len__(self):
+        return self.length
+
+    def add(self, parameter_list, energy, entropy):
+        r"""Archives one evaluated parameter vector."""
+        self.add_batch(np.atleast_2d(parameter_list), [energy], [entropy])
+
+    def add_batch(self, parameter_matrix, energies, entropies):
+        r"""Archives a batch of evaluated parameter vectors, shape (k, p)."""
+        parameter_matrix = np.atleast_2d(np.asarray(parameter_matrix, dtype=float))
+        if self.parameters is None:
+            self.parameters = np.full((self.size, parameter_matrix.shape[1]), np.nan)
+        for parameter_list, energy, entropy in zip(parameter_matrix, energies, entropies):
+            if self.length == self.size:
+                self.compress()
+            self.parameters[self.length] = parameter_list
+            self.energies[self.length] = np.real(energy)
+            self.entropies[self.length] = entropy
+            self.length += 1
+
+    def compress(self):
+        r"""Keeps the non-dominated points and the most recent ones, at most half of the size."""
+        kept_size = self.size // 2
+        energies = self.energies[: self.length]
+        entropies = self.entropies[: self.length]
+        # Sweep by increasing energy: a point is kept if no lower energy has higher entropy
+        order = np.argsort(energies, kind="stable")
+        best_entropies = np.maximum.accumulate(entropies[order])
+        front = order[entropies[order] >= best_entropies]
+        if len(front) > kept_size:
+            front = front[np.linspace(0, len(front) - 1, kept_size).astype(int)]
+        others = np.setdiff1d(np.arange(self.length), front)
+        recent = others[len(others) - (kept_size - len(front)) :]
+        kept = np.sort(np.concatenate([front, recent]))
+        self.parameters[: len(kept)] = self.parameters[kept]
+        self.energies[: len(kept)] = self.energies[kept]
+        self.entropies[: len(kept)] = self.entropies[kept]
+        self.parameters[len(kept) :] = np.nan
+        self.energies[len(kept) :] = np.nan
+        self.entropies[len(kept) :] = np.nan
+        self.length = len(kept)
+
+    def free_energies(self, betas):
+        r"""Returns :math:`\beta E - S` of every archived point for every beta, shape (points, betas)."""
+        return (
+            np.outer(self.energies[: self.length], np.atleast_1d(betas))
+            - self.entropies[: self.length, None]
+        )
+
+    def best(self, beta, n=1):
+        r"""Returns the n archived parameter vectors with the lowest free energy at beta and
+        Their free energies, or None, None if the archive is empty."""
+        if self.length == 0:
+            return None, None
+        free_energies = self.free_energies(beta)[:, 0]
+        order = np.argsort(free_energies)[:n]
+        return self.parameters[order].copy(), free_energies[order]
+
+    def get_data(self):
+        r"""Returns the archived points as dictionary of arrays."""
+        return {
+            "parameters": None
+            if self.parameters is None
+            else self.parameters[: self.length].copy(),
+            "energy": self.energies[: self.length].copy(),
+            "entropy": self.entropies[: self.length].copy(),
+        }
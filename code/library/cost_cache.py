@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+r"""
+Class of a least-recently-used memo cache for the cost function evaluations.
+
+Optimizers (COBYLA restarts, SPSA calibration, multi-start runs) often evaluate the same
+parameter vector more than once. The key of an evaluation is the bytes of the parameter
+vector rounded to a fixed number of decimals, plus any other argument the value depends
+on (e.g. beta and shots), so points equal up to round-off share the same entry.
+
+
+
+Created on Mon Oct 19 23:08:45 2026
+
+@author: DeWitt
+"""
+import numpy as np
+from collections import OrderedDict
+
+
+class cost_cache:
+    r"""LRU cache of cost function evaluations, with hit/miss statistics.
+
+    Args:
+        size: Maximum number of entries, the least recently used are dropped. 0 turns it off.
+        decimals: Decimals of the parameters kept in the key.
+    """
+
+    def __init__(self, size=4096, decimals=10):
+        self.size = size
+        self.decimals = decimals
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self):
+        return len(self.entries)
+
+    def key(self, parameter_list, *args):
+        r"""Returns the key of parameter_list and the other arguments args."""
+        # + 0.0 turns -0.0 into 0.0, which has different bytes
+        rounded = np.round(np.asarray(parameter_list, dtype=float), self.decimals) + 0.0
+        return (rounded.tobytes(),) + args
+
+    def get(self, key):
+        r"""Returns the cached value of key, or None."""
+        if key in self.entries:
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return self.entries[key]
+        self.misses += 1
+        return None
+
+    def put(self, key, value):
+        if self.size == 0:
+            return
+        self.entries[key] = value
+        self.entries.move_to_end(key)
+        while len(self.entries) > self.size:
+            self.entries.popitem(last=False)
+
+    def clear(self):
+        self.entries.clear()
+
+    def get_statistics(self):
+        r"""Returns hits, misses, hit rate and number of entries."""
+        calls = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / calls if calls > 0 else np.nan,
+            "entries": len(self.entries),
+        }
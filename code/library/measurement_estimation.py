@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+r"""
+Functions to estimate MHETS quantities directly from measurement counts, without tomography.
+
+The ancilla register is always measured in the computational basis, so Its populations
+(and entropy) come from every circuit. The system register is rotated into the common
+eigenbasis of a qubit-wise commuting group of Pauli terms, so all the terms of a group
+come from the same counts: for each shot the eigenvalue of a term is the parity of the
+measured bits on Its support.
+
+
+
+Created on Mon Oct 19 18:14:27 2026
+
+@author: DeWitt
+"""
+import numpy as np
+
+
+def counts_to_arrays(counts):
+    r"""Converts a counts dictionary {bitstring: frequency} into integer outcomes and frequencies."""
+    outcomes = np.array([int(key.replace(" ", ""), 2) for key in counts.keys()], dtype=np.int64)
+    frequencies = np.array(list(counts.values()), dtype=np.int64)
+    return outcomes, frequencies
+
+
+def outcome_bits(outcomes, num_qubits, offset=0):
+    r"""Returns the bits of the qubits [offset, offset + num_qubits) of each outcome, shape (M, num_qubits)."""
+    return (outcomes[:, None] >> (offset + np.arange(num_qubits))) & 1
+
+
+def population_estimate(outcomes, frequencies, num_qubits, offset=0):
+    r"""Returns the estimated populations of the register of the qubits [offset, offset + num_qubits)."""
+    register_outcomes = (outcomes >> offset) & ((1 << num_qubits) - 1)
+    populations = np.bincount(register_outcomes, weights=frequencies, minlength=2 ** num_qubits)
+    return populations / np.sum(frequencies)
+
+
+def entropy_estimate(populations, shots):
+    r"""Plug-in estimate of the entropy of the populations.
+
+    Returns:
+        Entropy and the variance of the estimate, :math:`(\langle \log^2 p\rangle - S^2)/shots`.
+    """
+    nonzero_populations = populations[populations > 0.0]
+    log_populations = np.log(nonzero_populations)
+    entropy = -np.sum(nonzero_populations * log_populations)
+    variance = (np.sum(nonzero_populations * log_populations ** 2) - entropy ** 2) / shots
+    return entropy, variance
+
+
+def group_expectation_estimate(group, outcomes, frequencies, num_qubits, offset=0):
+    r"""Estimates the expectation value of a qubit-wise commuting group of Pauli terms.
+
+    Args:
+        group: SparsePauliOp of qubit-wise commuting terms, on the qubits [offset, offset + num_qubits).
+        outcomes, frequencies: Counts measured in the basis of the group (see pauli_grouping).
+        num_qubits: Number of qubits of the register of the group.
+        offset: First qubit of the register.
+
+    Returns:
+        Expectation value and the variance of the estimate. The variance is the one of the
+        sum of the terms per shot, so the covariances between terms are included.
+    """
+    bits = outcome_bits(outcomes, num_qubits, offset=offset)
+    support = (group.paulis.x | group.paulis.z).astype(int)
+    eigenvalues = 1 - 2 * ((bits @ support.T) % 2)
+    shot_values = eigenvalues @ np.real(group.coeffs)
+    shots = np.sum(frequencies)
+    mean = np.sum(frequencies * shot_values) / shots
+    variance = (np.sum(frequencies * shot_values ** 2) / shots - mean ** 2) / shots
+    return mean, variance
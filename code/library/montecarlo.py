@@ -8,6 +8,11 @@ Created on Wed Feb 28 18:55:30 2024
 @author: DeWitt
 """
 import numpy as np
+from contextlib import nullcontext
+from multiprocessing import Pool
+
+
+from library import recorder
 
 
 # from library.MHETS import MHETS_instance
@@ -21,6 +26,27 @@ def sort_result(total_result):
     return minimized_result
 
 
+def optimize_starting_point(task):
+    r"""Worker: optimizes one starting point. task = (instance, beta, parameter_list, options)."""
+    instance, beta, parameter_list, options = task
+    return instance.optimize(beta, initial_parameter_list_guess=parameter_list, **options)
+
+
+def merge_round(old_result, new_result):
+    r"""Joins the results of two successive rounds of the same starting point."""
+    merged_result = new_result.copy()
+    merged_result["Time optimization"] += old_result["Time optimization"]
+    merged_result["n_eval"] += old_result["n_eval"]
+    for key in ["n_grad", "n_cache_hits"]:
+        # None (e.g. n_grad of gradient-free optimizers) counts as 0 if the other is a number
+        if old_result.get(key) is not None or new_result.get(key) is not None:
+            merged_result[key] = (old_result.get(key) or 0) + (new_result.get(key) or 0)
+    merged_result["callback_data"] = recorder.merge_data(
+        old_result["callback_data"], new_result["callback_data"]
+    )
+    return merged_result
+
+
 def run(
     instance,
     beta,
@@ -29,7 +55,30 @@ def run(
     maxiter=1000,
     tol=1e-6,
     shots=1024,
+    processes=1,
+    halving_rounds=0,
+    eta=2,
 ):
+    r"""Multi-start optimization of one beta: the first starting point is the initial parameter
+    list of the instance, the others are random in :math:`[-\pi, \pi]`.
+
+    Args:
+        instance: MHETS_instance.
+        beta: Inverse temperature.
+        n_starting_point: Number of starting points.
+        optimizer, maxiter, tol, shots: Options of instance.optimize.
+        processes: Number of processes of the pool, 1 runs everything in this process.
+            With more processes the instance is pickled, so Its backend must be picklable.
+        halving_rounds: Number of successive halving cuts. maxiter is split in
+            halving_rounds + 1 rounds; after each round only the best 1/eta of the starting
+            points (by Helmoltz energy) continue from where they stopped, the others are
+            abandoned with their last result. 0 means every point gets the full maxiter.
+        eta: Reduction factor of successive halving.
+
+    Returns:
+        Result of the best starting point and dictionary with the lists of all the results.
+        With successive halving, "Rounds" is the number of rounds each point survived.
+    """
     starting_point_list = [instance.initial_parameter_list]
     for i in range(n_starting_point - 1):
         starting_point_list.append(
@@ -38,35 +87,54 @@ def run(
     print("ccccccccccccccccccccccccccc")
     print("Run for beta =", beta)
     print("ccccccccccccccccccccccccccc")
+    options = {
+        "optimizer": optimizer,
+        "maxiter": int(np.ceil(maxiter / (halving_rounds + 1))),
+        "tol": tol,
+        "shots": shots,
+    }
+    results = [None for _ in starting_point_list]
+    rounds = [0 for _ in starting_point_list]
+    alive = list(range(n_starting_point))
+    # The pool is closed even if a worker raises
+    with Pool(processes) if processes > 1 else nullcontext() as pool:
+        for halving_round in range(halving_rounds + 1):
+            tasks = [
+                (
+                    instance,
+                    beta,
+                    starting_point_list[index]
+                    if results[index] is None
+                    else results[index]["optimized_parameter_list"],
+                    options,
+                )
+                for index in alive
+            ]
+            if pool is None:
+                round_results = []
+                for task in tasks:
+                    round_results.append(optimize_starting_point(task))
+                    print("ccccccccccccccccccccccccccc")
+                    print("Starting point done")
+                    print("ccccccccccccccccccccccccccc")
+            else:
+                round_results = pool.map(optimize_starting_point, tasks, chunksize=1)
+            for index, result in zip(alive, round_results):
+                if results[index] is None:
+                    results[index] = result
+                else:
+                    results[index] = merge_round(results[index], result)
+                rounds[index] += 1
+            if halving_round < halving_rounds:
+                # Keep the most promising starting points
+                alive = sorted(alive, key=lambda index: results[index]["Helmoltz energy"])
+                alive = sorted(alive[: max(1, int(np.ceil(len(alive) / eta)))])
+                print("Successive halving: {} starting points left".format(len(alive)))
     total_result = {"Starting point": starting_point_list}
-    result = instance.optimize(
-        beta,
-        initial_parameter_list_guess=starting_point_list[0],
-        optimizer=optimizer,
-        maxiter=maxiter,
-        tol=tol,
-        shots=shots,
-    )
-    for key in result.keys():
-        total_result[key] = [result[key]]
-    print("ccccccccccccccccccccccccccc")
-    print("Initial starting point done")
-    print("ccccccccccccccccccccccccccc")
-
-    for parameter_list in starting_point_list[1:]:
-        result = instance.optimize(
-            beta,
-            initial_parameter_list_guess=parameter_list,
-            optimizer=optimizer,
-            maxiter=maxiter,
-            tol=tol,
-            shots=shots,
-        )
-        for key in result.keys():
-            total_result[key].append(result[key])
-        print("ccccccccccccccccccccccccccc")
-        print("Next starting point done")
-        print("ccccccccccccccccccccccccccc")
+    for key in results[0].keys():
+        total_result[key] = [result[key] for result in results]
+    if halving_rounds > 0:
+        total_result["Rounds"] = rounds
     minimized_result = sort_result(total_result)
 
     return minimized_result, total_result
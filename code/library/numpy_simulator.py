@@ -0,0 +1,282 @@
+# -*- coding: utf-8 -*-
+r"""
+Functions to simulate the two_local and pma ansatzes directly on NumPy statevectors.
+
+The gate structure of an ansatz is translated once into a list of operations
+(gate name, qubits, parameter index), then the gates are applied to a batch of states of
+shape (k, 2^N) with the qiskit little-endian convention. The batch can come from k parameter
+vectors, k initial states, or both. No QuantumCircuit is built, so the cost of an evaluation is
+just linear algebra.
+
+
+
+Created on Mon Oct 19 14:20:51 2026
+
+@author: DeWitt
+"""
+import numpy as np
+
+
+# Index pairs of the parity-sector gate application, keyed by (num_qubits, parity, qubits)
+sector_pairs_cache = {}
+
+
+def ansatz_operations(ansatz):
+    r"""Translates an ansatz into the list of Its operations, in the same order of ansatz.build().
+
+    Args:
+        ansatz: two_local or pma instance.
+
+    Returns:
+        List of (gate name, qubits, parameter index) tuples, parameter index is None for cx.
+    """
+    operations = []
+    num_qubits = ansatz.get_num_qubits()
+    if ansatz.get_name() == "two_local":
+        layer_size = num_qubits * len(ansatz.get_rotation_blocks())
+
+        def rotation_layer(offset):
+            for qubit in range(num_qubits):
+                for gate in ansatz.get_rotation_blocks():
+                    # Same parameter for all the rotation blocks of a qubit, as in add_rotation_layer
+                    operations.append((gate, (qubit,), offset + qubit))
+
+        for rep in range(ansatz.get_num_reps()):
+            rotation_layer(rep * layer_size)
+            if ansatz.get_entanglement() == "linear":
+                for qubit in range(num_qubits - 1):
+                    operations.append(("cx", (qubit, qubit + 1), None))
+            elif ansatz.get_entanglement() == "all":
+                for control_qubit in range(num_qubits - 1):
+                    for distance in range(1, num_qubits - control_qubit):
+                        operations.append(("cx", (control_qubit, control_qubit + distance), None))
+        rotation_layer(ansatz.get_num_reps() * layer_size)
+    elif ansatz.get_name() == "pma":
+        if ansatz.get_architecture() == "linear":
+            pairs = [(qubit, qubit + 1) for qubit in range(num_qubits - 1)]
+        elif ansatz.get_architecture() == "full":
+            pairs = [
+                (first_qubit, first_qubit + distance)
+                for first_qubit in range(num_qubits - 1)
+                for distance in range(1, num_qubits - first_qubit)
+            ]
+        for rep in range(ansatz.get_num_reps() + 1):
+            offset = rep * 2 * len(pairs)
+            for par_counter, pair in enumerate(pairs):
+                # Parameter counter moves by one per pair, as in pma.add_layer
+                operations.append(("rxy", pair, offset + par_counter))
+                operations.append(("ryx", pair, offset + par_counter + 1))
+    return operations
+
+
+def gate_matrices(gate, theta):
+    r"""Returns the matrices of a parametric gate for an array of angles, shape (len(theta), d, d)."""
+    cos = np.cos(theta / 2.0)
+    sin = np.sin(theta / 2.0)
+    zero = np.zeros_like(theta)
+    if gate == "rx":
+        matrices = [[cos, -1j * sin], [-1j * sin, cos]]
+    elif gate == "ry":
+        matrices = [[cos, -sin], [sin, cos]]
+    elif gate == "rz":
+        matrices = [[np.exp(-0.5j * theta), zero], [zero, np.exp(0.5j * theta)]]
+    elif gate == "rxy":  # Same as RXYGate.__array__
+        matrices = [
+            [cos, zero, zero, -sin],
+            [zero, cos, -sin, zero],
+            [zero, sin, cos, zero],
+            [sin, zero, zero, cos],
+        ]
+    elif gate == "ryx":  # Same as RYXGate.__array__
+        matrices = [
+            [cos, zero, zero, -sin],
+            [zero, cos, sin, zero],
+            [zero, -sin, cos, zero],
+            [sin, zero, zero, cos],
+        ]
+    else:
+        raise ValueError("Gate {} not supported by the NumPy simulator".format(gate))
+    return np.moveaxis(np.array(matrices, dtype=complex), -1, 0)
+
+
+def apply_single_qubit_gate(states, matrices, qubit):
+    r"""Applies (1 or k) 2x2 matrices on qubit to a batch of states of shape (k, 2^N)."""
+    k, dimension = states.shape
+    tensor = states.reshape(k, dimension // (2 << qubit), 2, 1 << qubit)
+    tensor = matrices[:, None, :, :] @ tensor
+    return tensor.reshape(k, dimension)
+
+
+def apply_two_qubit_gate(states, matrices, qubits):
+    r"""Applies (1 or k) 4x4 matrices on qubits = (q0, q1) to a batch of states of shape (k, 2^N).
+
+    Matrices follow the qiskit ordering: index :math:`b_{q_0} + 2 b_{q_1}`.
+    """
+    q0, q1 = qubits
+    if q0 > q1:
+        q0, q1 = q1, q0
+        matrices = matrices.reshape(-1, 2, 2, 2, 2).transpose(0, 2, 1, 4, 3).reshape(-1, 4, 4)
+    k, dimension = states.shape
+    tensor = states.reshape(k, dimension >> (q1 + 1), 2, 1 << (q1 - q0 - 1), 2, 1 << q0)
+    tensor = tensor.transpose(0, 1, 3, 2, 4, 5)
+    shape = tensor.shape
+    tensor = matrices[:, None, None, :, :] @ tensor.reshape(shape[0], shape[1], shape[2], 4, shape[5])
+    tensor = tensor.reshape(shape).transpose(0, 1, 3, 2, 4, 5)
+    return tensor.reshape(k, dimension)
+
+
+def apply_cx(states, qubits):
+    control, target = qubits
+    indices = np.arange(states.shape[1])
+    permutation = np.where((indices >> control) & 1, indices ^ (1 << target), indices)
+    return states[:, permutation]
+
+
+def operation_angles(operations, parameters):
+    r"""Returns the angle of every parametric operation, shape (k, number of parametric operations)."""
+    parameter_indices = [operation[2] for operation in operations if operation[2] is not None]
+    return np.atleast_2d(parameters)[:, parameter_indices]
+
+
+def simulate(operations, num_qubits, angles, initial_states=None):
+    r"""Applies a list of operations to a batch of states.
+
+    Args:
+        operations: List of operations (see ansatz_operations).
+        num_qubits: Number of qubits.
+        angles: Angles of the parametric operations, shape (1 or k, number of parametric operations).
+        initial_states: Initial states, shape (1 or k, 2^N). Default is :math:`|0\rangle`.
+
+    Returns:
+        Final states, shape (k, 2^N).
+    """
+    angles = np.atleast_2d(angles)
+    if initial_states is None:
+        initial_states = np.zeros((1, 2 ** num_qubits), dtype=complex)
+        initial_states[0, 0] = 1.0
+    states = np.atleast_2d(initial_states).astype(complex)
+    if states.shape[0] == 1 and angles.shape[0] > 1:
+        states = np.repeat(states, angles.shape[0], axis=0)
+    angle_index = 0
+    for gate, qubits, parameter_index in operations:
+        if gate == "cx":
+            states = apply_cx(states, qubits)
+            continue
+        matrices = gate_matrices(gate, angles[:, angle_index])
+        angle_index += 1
+        if len(qubits) == 1:
+            states = apply_single_qubit_gate(states, matrices, qubits[0])
+        else:
+            states = apply_two_qubit_gate(states, matrices, qubits)
+    return states
+
+
+def shifted_angles(angles):
+    r"""Returns the angles with each parametric operation shifted by :math:`+\pi/2` (first n rows)
+    and :math:`-\pi/2` (last n rows), shape (2n, n). All the gates are Pauli rotations
+    (RXY and RYX too), so these are the points of the parameter-shift rule."""
+    angles = np.ravel(angles)
+    shifts = np.pi / 2.0 * np.eye(len(angles))
+    return np.concatenate([angles + shifts, angles - shifts])
+
+
+def parameter_shift_gradient(operations, shifted_values, num_parameters):
+    r"""Gradient wrt the ansatz parameters from the values of a function at shifted_angles.
+
+    A parameter used by more operations (see ansatz_operations) gets the sum of their terms.
+    """
+    shifted_values = np.asarray(shifted_values)
+    n = len(shifted_values) // 2
+    operation_gradient = (shifted_values[:n] - shifted_values[n:]) / 2.0
+    parameter_indices = [operation[2] for operation in operations if operation[2] is not None]
+    gradient = np.zeros(num_parameters)
+    np.add.at(gradient, parameter_indices, operation_gradient)
+    return gradient
+
+
+def parity_sector_indices(num_qubits, parity):
+    r"""Returns the sorted computational basis indices with :math:`\prod_i Z_i` = parity (+1 or -1),
+    same order as spin_hamiltonian.get_parity_indices."""
+    indices = np.arange(2 ** num_qubits)
+    odd = np.sum((indices[:, None] >> np.arange(num_qubits)) & 1, axis=1) % 2 == 1
+    return indices[odd] if parity == -1 else indices[~odd]
+
+
+def sector_pairs(num_qubits, parity, qubits):
+    r"""Returns the pairs of sector positions connected by a parity-preserving two-qubit gate.
+
+    A gate that only couples :math:`|00\rangle, |11\rangle` and :math:`|01\rangle, |10\rangle`
+    maps each sector state with :math:`b_{q_0} = 0` to Its partner with both bits flipped.
+
+    Returns:
+        Positions of the states with :math:`b_{q_0} = 0`, positions of their partners and the
+        matrix indices (:math:`b_{q_0} + 2 b_{q_1}`) of both.
+    """
+    key = (num_qubits, parity, tuple(qubits))
+    if key not in sector_pairs_cache:
+        q0, q1 = qubits
+        indices = parity_sector_indices(num_qubits, parity)
+        lower = indices[((indices >> q0) & 1) == 0]
+        upper = lower ^ ((1 << q0) | (1 << q1))
+        lower_matrix_indices = 2 * ((lower >> q1) & 1)
+        sector_pairs_cache[key] = (
+            np.searchsorted(indices, lower),
+            np.searchsorted(indices, upper),
+            lower_matrix_indices,
+            3 - lower_matrix_indices,
+        )
+    return sector_pairs_cache[key]
+
+
+def simulate_sector(operations, num_qubits, angles, parity, initial_states):
+    r"""Applies a list of parity-preserving operations to a batch of states of one parity sector.
+
+    Args:
+        operations: List of operations (see ansatz_operations), only rxy and ryx gates.
+        num_qubits: Number of qubits.
+        angles: Angles of the operations, shape (1 or k, number of operations).
+        parity: Parity of the sector (+1 or -1).
+        initial_states: Initial states in the sector basis (see parity_sector_indices),
+            shape (1 or k, 2^(N-1)).
+
+    Returns:
+        Final states in the sector basis, shape (k, 2^(N-1)).
+    """
+    angles = np.atleast_2d(angles)
+    states = np.atleast_2d(initial_states).astype(complex)
+    if states.shape[0] == 1 and angles.shape[0] > 1:
+        states = np.repeat(states, angles.shape[0], axis=0)
+    for angle_index, (gate, qubits, parameter_index) in enumerate(operations):
+        if gate not in ["rxy", "ryx"]:
+            raise ValueError("Gate {} is not supported in the parity sectors".format(gate))
+        matrices = gate_matrices(gate, angles[:, angle_index])
+        lower, upper, a, b = sector_pairs(num_qubits, parity, qubits)
+        lower_states = states[:, lower]
+        upper_states = states[:, upper]
+        states = np.empty_like(states)
+        states[:, lower] = matrices[:, a, a] * lower_states + matrices[:, a, b] * upper_states
+        states[:, upper] = matrices[:, b, a] * lower_states + matrices[:, b, b] * upper_states
+    return states
+
+
+def basis_states(indices, num_qubits):
+    r"""Returns the computational basis states :math:`|k\rangle` for k in indices, shape (len(indices), 2^N)."""
+    states = np.zeros((len(indices), 2 ** num_qubits), dtype=complex)
+    states[np.arange(len(indices)), indices] = 1.0
+    return states
+
+
+def apply_ansatz(ansatz, parameters, initial_states=None):
+    r"""Simulates an ansatz for one or a batch of parameter vectors.
+
+    Args:
+        ansatz: two_local or pma instance.
+        parameters: Parameter vector (p,) or batch of parameter vectors (k, p).
+        initial_states: Initial states, shape (1 or k, 2^N). Default is :math:`|0\rangle`.
+
+    Returns:
+        Final states, shape (k, 2^N).
+    """
+    operations = ansatz_operations(ansatz)
+    angles = operation_angles(operations, np.asarray(parameters, dtype=float))
+    return simulate(operations, ansatz.get_num_qubits(), angles, initial_states)
@@ -1,6 +1,8 @@
 # -*- coding: utf-8 -*-
 r"""
-Class to generate an LMG Hamiltonian and numerically get eigenstates, thermal averages, ecc.
+Class to generate an LMG Hamiltonian (and general two-body spin models) and numerically get
+eigenstates, thermal averages, ecc.
+The collective-spin (Dicke) representation gives exact results for large N.
 
 
 
@@ -12,16 +14,154 @@ Created on Sat Dec  9 17:40:05 2023
 # TODO: Add error raising
 import numpy as np
 import time
-from qiskit.quantum_info import SparsePauliOp
+from scipy.linalg import eigh_tridiagonal
+from scipy.sparse import coo_matrix, csr_matrix, issparse
+from scipy.sparse.linalg import eigsh, lobpcg, norm as sparse_norm
+from scipy.special import gammaln, logsumexp
+from qiskit.quantum_info import SparsePauliOp, PauliList, DensityMatrix
 
 
-class LMG_hamiltonian:
-    def __init__(self, N: int, gy: float, B: float):
+from library import trace_estimation, pauli_grouping
+
+
+def spin_model_pauli(N: int, Jxx=None, Jyy=None, Jzz=None, hx=None, hy=None, hz=None):
+    r"""Builds the SparsePauliOp of a general spin model directly from symplectic arrays.
+
+    .. math::
+
+        H = \sum_{i<j} (J^{xx}_{ij} X_i X_j + J^{yy}_{ij} Y_i Y_j + J^{zz}_{ij} Z_i Z_j)
+        + \sum_i (h^x_i X_i + h^y_i Y_i + h^z_i Z_i)
+
+    Args:
+        N: Number of spins.
+        Jxx, Jyy, Jzz: Two-body couplings as N x N matrices (only i < j is read) or scalars for
+            uniform all-to-all couplings. None means no coupling.
+        hx, hy, hz: Fields as length N arrays or scalars for uniform fields.
+
+    Returns:
+        SparsePauliOp with the single-body terms first (x, y, z), then the two-body ones. Terms
+        with zero coefficient are dropped. Qubit indices follow the qiskit convention.
+    """
+    first, second = np.triu_indices(N, k=1)
+    x_blocks, z_blocks, coeff_blocks = [], [], []
+    for field, (has_x, has_z) in zip((hx, hy, hz), ((True, False), (True, True), (False, True))):
+        if field is None:
+            continue
+        coeffs = np.broadcast_to(np.asarray(field, dtype=float), (N,))
+        qubits = np.flatnonzero(coeffs)
+        table = np.zeros((len(qubits), N), dtype=bool)
+        table[np.arange(len(qubits)), qubits] = True
+        x_blocks.append(table & has_x)
+        z_blocks.append(table & has_z)
+        coeff_blocks.append(coeffs[qubits])
+    for coupling, (has_x, has_z) in zip(
+        (Jxx, Jyy, Jzz), ((True, False), (True, True), (False, True))
+    ):
+        if coupling is None:
+            continue
+        coeffs = np.broadcast_to(np.asarray(coupling, dtype=float), (N, N))[first, second]
+        pairs = np.flatnonzero(coeffs)
+        table = np.zeros((len(pairs), N), dtype=bool)
+        table[np.arange(len(pairs)), first[pairs]] = True
+        table[np.arange(len(pairs)), second[pairs]] = True
+        x_blocks.append(table & has_x)
+        z_blocks.append(table & has_z)
+        coeff_blocks.append(coeffs[pairs])
+    if len(coeff_blocks) == 0 or sum(len(coeffs) for coeffs in coeff_blocks) == 0:
+        return SparsePauliOp(N * "I", 0.0)
+    paulis = PauliList.from_symplectic(np.vstack(z_blocks), np.vstack(x_blocks))
+    return SparsePauliOp(paulis, np.concatenate(coeff_blocks))
+
+
+def bit_parity(array):
+    r"""Parity of the number of set bits of each (up to 64-bit) integer in array."""
+    array = array.copy()
+    for shift in (32, 16, 8, 4, 2, 1):
+        array ^= array >> shift
+    return array & 1
+
+
+def pauli_to_sparse(pauli: SparsePauliOp):
+    r"""Builds the CSR matrix of a SparsePauliOp from Its symplectic representation.
+
+    Each Pauli string maps :math:`|j\rangle` to :math:`i^{n_Y} (-1)^{|j \wedge z|} |j \oplus x\rangle`,
+    so terms sharing the same x mask fill the same sparsity pattern and are summed up before
+    building the matrix. The matrix is real when all the entries are.
+    """
+    N = pauli.num_qubits
+    powers = 1 << np.arange(N, dtype=np.int64)
+    x_masks = pauli.paulis.x.astype(np.int64) @ powers
+    z_masks = pauli.paulis.z.astype(np.int64) @ powers
+    num_y = np.sum(pauli.paulis.x & pauli.paulis.z, axis=1)
+    # Phase of the group (-i)^phase and the Y's phase i^{n_Y}
+    coeffs = pauli.coeffs * (1j) ** ((num_y - pauli.paulis.phase) % 4)
+    columns = np.arange(2 ** N, dtype=np.int64)
+    rows_list, columns_list, data_list = [], [], []
+    for x_mask in np.unique(x_masks):
+        terms = np.flatnonzero(x_masks == x_mask)
+        data = np.zeros(2 ** N, dtype=complex)
+        for term in terms:
+            data += coeffs[term] * (1 - 2 * bit_parity(columns & z_masks[term]))
+        rows_list.append(columns ^ x_mask)
+        columns_list.append(columns)
+        data_list.append(data)
+    data = np.concatenate(data_list)
+    if np.all(np.imag(data) == 0.0):
+        data = np.real(data)
+    matrix = coo_matrix(
+        (data, (np.concatenate(rows_list), np.concatenate(columns_list))), shape=(2 ** N, 2 ** N)
+    ).tocsr()
+    matrix.eliminate_zeros()
+    return matrix
+
+
+def thermal_table(eigenvalues, betas):
+    r"""Computes the exact thermodynamics for an array of betas from the eigenvalues.
+
+    Returns:
+        Dictionary of arrays with the same length of betas: log Z, free energy
+        :math:`F = -\log Z` (the minimum of the MHETS cost :math:`\beta E - S`), energy
+        :math:`E = -\partial_{\beta} \log Z`, entropy and heat capacity
+        :math:`C = \beta^2 (\langle H^2 \rangle - E^2)`.
+    """
+    betas = np.atleast_1d(np.asarray(betas, dtype=float))
+    log_weights = -np.outer(betas, eigenvalues)
+    log_Z = logsumexp(log_weights, axis=1)
+    probabilities = np.exp(log_weights - log_Z[:, None])
+    energy = probabilities @ eigenvalues
+    energy_variance = probabilities @ eigenvalues ** 2 - energy ** 2
+    table = {
+        "betas": betas,
+        "log_partition_function": log_Z,
+        "free_energy": -log_Z,
+        "energy": energy,
+        "entropy": betas * energy + log_Z,
+        "heat_capacity": betas ** 2 * energy_variance,
+    }
+    return table
+
+
+class spin_hamiltonian:
+    r"""
+    General two-body spin Hamiltonian (see spin_model_pauli) with the numerical tools to get
+    eigenstates, thermal states, thermal averages, ecc.
+    """
+
+    def __init__(self, N: int, Jxx=None, Jyy=None, Jzz=None, hx=None, hy=None, hz=None):
         self.N = N
-        self.gy = gy
-        self.B = B
-        self.pauli_list, self.coeff_list = self.op_list(N=self.N, gy=self.gy, B=self.B)
-        self.pauli = SparsePauliOp(self.pauli_list, self.coeff_list)
+        self.pauli = spin_model_pauli(N, Jxx=Jxx, Jyy=Jyy, Jzz=Jzz, hx=hx, hy=hy, hz=hz)
+        self.pauli_list = self.pauli.paulis.to_labels()
+        self.coeff_list = list(np.real(self.pauli.coeffs))
+        self.sparse_matrix = None
+        self.parity_spectrum = None
+        self.spectrum = None
+        self.eigenvalues = None
+        self.measurement_groups = None
+        self.parity_blocks = None
+
+    def conserves_parity(self):
+        r"""True if every term commutes with :math:`\Pi = \prod_i Z_i`, i.e. has an even number of X, Y."""
+        return bool(np.all(np.sum(self.pauli.paulis.x, axis=1) % 2 == 0))
 
     def get_pauli(self):
         return self.pauli
@@ -29,53 +169,159 @@ class LMG_hamiltonian:
     def get_matrix(self):
         return self.pauli.to_matrix()
 
-    def get_ground_state(self):
-        eigenvalues, eigenstates = self.diagonalize(self.pauli.to_matrix())
+    def get_measurement_groups(self):
+        r"""Returns the qubit-wise commuting groups of the Pauli terms (see pauli_grouping), cached."""
+        if self.measurement_groups is None:
+            self.measurement_groups = pauli_grouping.group_observable(self.pauli)
+        return self.measurement_groups
+
+    def get_sparse_matrix(self):
+        r"""Returns the Hamiltonian as a scipy CSR matrix, built once and cached."""
+        if self.sparse_matrix is None:
+            self.sparse_matrix = pauli_to_sparse(self.pauli)
+        return self.sparse_matrix
+
+    def get_ground_state(self, sparse=False):
+        if sparse is True:
+            eigenvalues, eigenstates = self.get_low_spectrum(k=1)
+        else:
+            eigenvalues, eigenstates = self.get_eigenstates()
         return eigenvalues[0], eigenstates[0]
 
     def get_eigenstates(self):
-        eigenvalues, eigenstates = self.diagonalize(self.pauli.to_matrix())
+        r"""Returns the sorted eigenvalues and eigenstates, computed block-wise in the parity sectors."""
+        eigenvalues, eigenvectors = self.get_spectrum()
+        return list(eigenvalues), [eigenvectors[:, i] for i in range(len(eigenvalues))]
+
+    def get_parity_indices(self):
+        r"""Returns the computational basis indices of the parity sectors :math:`\Pi = \prod_i Z_i = \pm 1`.
+
+        If H doesn't conserve parity, a single sector (+1) with all the indices is returned.
+
+        Returns:
+            Dictionary with the parity (+1, -1) as keys and the sorted indices as values.
+        """
+        indices = np.arange(2 ** self.N)
+        if not self.conserves_parity():
+            return {1: indices}
+        odd = bit_parity(indices).astype(bool)
+        return {1: indices[~odd], -1: indices[odd]}
+
+    def get_parity_blocks(self):
+        r"""Returns the two :math:`2^{N-1}`-dimensional blocks of H in the parity sectors, cached.
+
+        Returns:
+            Dictionary with the parity (+1, -1) as keys and the sparse blocks as values.
+        """
+        if self.parity_blocks is None:
+            H = self.get_sparse_matrix()
+            self.parity_blocks = {}
+            for sector, indices in self.get_parity_indices().items():
+                self.parity_blocks[sector] = H[indices][:, indices]
+        return self.parity_blocks
+
+    def get_parity_spectrum(self):
+        r"""Diagonalizes the parity blocks, cached after the first call.
+
+        Returns:
+            Dictionary with the parity (+1, -1) as keys and (eigenvalues, eigenvectors as columns
+            in the sector basis) as values.
+        """
+        if self.parity_spectrum is None:
+            start = time.time()
+            self.parity_spectrum = {}
+            for sector, block in self.get_parity_blocks().items():
+                self.parity_spectrum[sector] = np.linalg.eigh(block.toarray())
+            self.time_to_diagonalize = time.time() - start
+        return self.parity_spectrum
+
+    def get_spectrum(self):
+        r"""Returns the sorted eigenvalues and the eigenvectors (as columns) in the full space, cached."""
+        if self.spectrum is None:
+            eigenvalues = np.zeros(2 ** self.N)
+            eigenvectors = np.zeros((2 ** self.N, 2 ** self.N), dtype=complex)
+            position = 0
+            for sector, (w, v) in self.get_parity_spectrum().items():
+                indices = self.get_parity_indices()[sector]
+                eigenvalues[position : position + len(w)] = w
+                eigenvectors[indices, position : position + len(w)] = v
+                position += len(w)
+            order = np.argsort(eigenvalues, kind="stable")
+            self.spectrum = (eigenvalues[order], eigenvectors[:, order])
+        return self.spectrum
+
+    def get_eigenvalues(self):
+        r"""Returns the sorted eigenvalues, cached, joining the ones of the parity blocks without
+        building the :math:`2^N \times 2^N` eigenvector matrix of get_spectrum."""
+        if self.eigenvalues is None:
+            self.eigenvalues = np.sort(
+                np.concatenate([w for w, v in self.get_parity_spectrum().values()]), kind="stable"
+            )
+        return self.eigenvalues
+
+    def get_log_partition_function(self, betas):
+        r"""Returns :math:`\log Z(\beta)` for an array of betas (a float for a single beta)."""
+        eigenvalues = self.get_eigenvalues()
+        log_Z = logsumexp(-np.outer(np.atleast_1d(betas), eigenvalues), axis=1)
+        return log_Z if np.ndim(betas) > 0 else log_Z[0]
+
+    def get_sector_partition_functions(self, beta):
+        r"""Returns the partition functions :math:`Z_{\pm}(\beta)` of the parity sectors."""
+        return {
+            sector: np.sum(np.exp(-beta * w)) for sector, (w, v) in self.get_parity_spectrum().items()
+        }
+
+    def get_low_spectrum(self, k=6, method="eigsh", tol=1e-10):
+        r"""Computes the k lowest eigenpairs with an iterative solver on the sparse Hamiltonian.
+
+        Args:
+            k: Number of eigenpairs.
+            method: "eigsh" (Lanczos) or "lobpcg".
+            tol: Tolerance of the iterative solver.
+
+        Returns:
+            Sorted eigenvalues and eigenstates, in the same format of diagonalize.
+        """
+        start = time.time()
+        H = self.get_sparse_matrix()
+        if k >= H.shape[0] - 1:  # Iterative solvers need k < dimension - 1
+            w, v = np.linalg.eigh(H.toarray())
+            w, v = w[:k], v[:, :k]
+        elif method == "eigsh":
+            w, v = eigsh(H, k=k, which="SA", tol=tol)
+        elif method == "lobpcg":
+            rng = np.random.default_rng(seed=0)
+            X = rng.standard_normal((H.shape[0], k)).astype(H.dtype)
+            w, v = lobpcg(H, X, largest=False, tol=tol, maxiter=1000)
+        order = np.argsort(w)
+        eigenvalues = [w[i] for i in order]
+        eigenstates = [v[:, i] for i in order]
+        self.time_to_diagonalize = time.time() - start
         return eigenvalues, eigenstates
 
     def get_partition_function(self, beta):
-        Z, rho = self.thermalize(self.get_matrix(), beta)
-        return Z
+        return sum(self.get_sector_partition_functions(beta).values())
+
+    def get_parity_probabilities(self, beta):
+        r"""Returns the Boltzmann probabilities of the eigenstates of each parity block.
+
+        Energies are shifted by the ground state energy to avoid overflows at large beta.
+        """
+        spectrum = self.get_parity_spectrum()
+        ground_state_energy = min(w[0] for w, v in spectrum.values())
+        weights = {sector: np.exp(-beta * (w - ground_state_energy)) for sector, (w, v) in spectrum.items()}
+        Z = sum(np.sum(weight) for weight in weights.values())
+        return {sector: weight / Z for sector, weight in weights.items()}
 
     def get_thermal_state(self, beta):
-        Z, rho = self.thermalize(self.get_matrix(), beta)
+        r"""Builds the thermal state block-wise, since it is block diagonal in the parity sectors."""
+        probabilities = self.get_parity_probabilities(beta)
+        rho = np.zeros([2 ** self.N, 2 ** self.N], dtype=complex)
+        for sector, (w, v) in self.get_parity_spectrum().items():
+            indices = self.get_parity_indices()[sector]
+            rho[np.ix_(indices, indices)] = (v * probabilities[sector]) @ v.conj().T
         return rho
 
-    def op_list(self, N: int, gy: float, B: float):
-        field_list = []
-        x_interaction_list = []
-        y_interaction_list = []
-        for spin_i in range(N):
-            if B != 0.00:
-                field_list.append(spin_i * "I" + "Z" + (N - spin_i - 1) * "I")
-            for spin_j in range(N):
-                if spin_j > spin_i:
-                    x_interaction_list.append(
-                        spin_i * "I"
-                        + "X"
-                        + (spin_j - spin_i - 1) * "I"
-                        + "X"
-                        + (N - spin_j - 1) * "I"
-                    )
-                    if gy != 0.00:
-                        y_interaction_list.append(
-                            spin_i * "I"
-                            + "Y"
-                            + (spin_j - spin_i - 1) * "I"
-                            + "Y"
-                            + (N - spin_j - 1) * "I"
-                        )
-        coeff_list = (
-            [-B] * len(field_list)
-            + [-1.0 / N] * len(x_interaction_list)
-            + [-gy / N] * len(y_interaction_list)
-        )
-        return field_list + x_interaction_list + y_interaction_list, coeff_list
-
     def diagonalize(self, op):
         start = time.time()
         w, v = np.linalg.eigh(op)
@@ -100,17 +346,146 @@ class LMG_hamiltonian:
         return Z, rho
 
     def thermal_average(self, op, beta):
-        average = np.trace(op @ self.get_thermal_state(beta))
+        r"""Computes :math:`\mathrm{Tr}[O \rho_{\beta}]` block-wise: only the diagonal parity blocks of op contribute."""
+        if isinstance(op, SparsePauliOp):
+            op = op.to_matrix(sparse=True).tocsr()
+        probabilities = self.get_parity_probabilities(beta)
+        average = 0.0
+        for sector, (w, v) in self.get_parity_spectrum().items():
+            indices = self.get_parity_indices()[sector]
+            if issparse(op):
+                op_block = op[indices][:, indices]
+            else:
+                op_block = op[np.ix_(indices, indices)]
+            exp_values = np.sum(v.conj() * (op_block @ v), axis=0)
+            average += np.sum(probabilities[sector] * exp_values)
         return average
 
+    def thermal_average_truncated(self, op, beta, k=20, method="eigsh"):
+        r"""Thermal average on the k lowest eigenstates, for low temperatures and large N.
+
+        The neglected states have energy at least :math:`E_{k-1}`, so their relative weight is
+        :math:`\epsilon \leq (D - k) e^{-\beta (E_{k-1} - E_0)} / \sum_{i<k} e^{-\beta (E_i - E_0)}`
+        and the error on the average is at most :math:`2 \|O\| \epsilon`.
+
+        Args:
+            op: Observable as SparsePauliOp, scipy sparse matrix or numpy array.
+            beta: Inverse temperature.
+            k: Number of eigenstates kept.
+            method: Iterative eigensolver, see get_low_spectrum.
+
+        Returns:
+            Truncated thermal average and Its error bound.
+        """
+        eigenvalues, eigenstates = self.get_low_spectrum(k=k, method=method)
+        eigenvalues = np.array(eigenvalues)
+        eigenstates = np.array(eigenstates).T
+        if isinstance(op, SparsePauliOp):
+            op_norm = np.sum(np.abs(op.coeffs))
+            op = op.to_matrix(sparse=True)
+        elif issparse(op):
+            op_norm = sparse_norm(op, 1)  # Bounds the spectral norm of Hermitian operators
+        else:
+            op_norm = np.linalg.norm(op, 1)
+        weights = np.exp(-beta * (eigenvalues - eigenvalues[0]))
+        exp_values = np.sum(eigenstates.conj() * (op @ eigenstates), axis=0)
+        average = np.sum(weights * exp_values) / np.sum(weights)
+        dimension = 2 ** self.N
+        epsilon = (dimension - len(eigenvalues)) * weights[-1] / np.sum(weights)
+        return average, 2.0 * op_norm * epsilon
+
+    def stochastic_thermal_average(self, op, betas, num_vectors=20, krylov_dim=40, seed=None):
+        r"""Thermal averages for N beyond exact diagonalization, with error bars.
+
+        See trace_estimation.stochastic_thermal_average, all the betas come from the same
+        Lanczos runs on the sparse Hamiltonian.
+        """
+        return trace_estimation.stochastic_thermal_average(
+            self.get_sparse_matrix(),
+            op,
+            betas,
+            num_vectors=num_vectors,
+            krylov_dim=krylov_dim,
+            seed=seed,
+        )
+
+    def thermodynamics(self, betas):
+        r"""Returns the exact thermodynamics (see thermal_table) from the cached eigenvalues, vectorized over betas."""
+        return thermal_table(self.get_eigenvalues(), betas)
+
+    def free_energy(self, betas):
+        r"""Returns :math:`F(\beta) = -\log Z(\beta)`, for an array of betas or a single beta."""
+        return -self.get_log_partition_function(betas)
+
     def cost_function(self, beta):
-        entropy = 0.0
-        eigenvalues, eigenstates = self.diagonalize(self.get_thermal_state(beta))
-        for eigenvalue in eigenvalues:
-            if eigenvalue != 0.0:
-                entropy -= eigenvalue * np.log(eigenvalue)
-        energy = self.thermal_average(self.get_matrix(), beta)
-        return np.real(beta * energy - entropy)
+        r"""Exact minimum of the MHETS cost :math:`\beta E - S`, which is :math:`-\log Z(\beta)`."""
+        return self.free_energy(beta)
+
+    def thermal_state_metrics(
+        self,
+        rho_list,
+        betas,
+        metrics=("relative_entropy", "trace_distance", "fidelity"),
+        paired=False,
+    ):
+        r"""Compares a list of states with the thermal states of many betas in one call.
+
+        Everything is computed in the eigenbasis of H, where :math:`\sigma_{\beta}` is
+        diagonal and :math:`\log \sigma_{\beta} = -\beta H - \log Z(\beta)`, so that
+        :math:`S(\rho\|\sigma_{\beta}) = -S(\rho) + \beta \mathrm{Tr}[\rho H] + \log Z(\beta)`
+        only needs the spectrum of each :math:`\rho` once.
+
+        Args:
+            rho_list: List of density matrices (DensityMatrix or numpy arrays).
+            betas: List of inverse temperatures of the thermal states.
+            metrics: Metrics to compute among "relative_entropy" (Umegaki), "trace_distance" and
+                "fidelity" (Uhlmann, squared as in qiskit state_fidelity).
+            paired: If True, rho_list[i] is compared only with the thermal state of betas[i]
+                (same lengths), e.g. the MHETS state of each beta with Its own target.
+
+        Returns:
+            Dictionary with the metrics as keys and arrays of shape (len(rho_list), len(betas)),
+            or (len(rho_list),) if paired.
+        """
+        eigenvalues, eigenvectors = self.get_spectrum()
+        betas = np.atleast_1d(np.asarray(betas, dtype=float))
+        if paired and len(betas) != len(rho_list):
+            raise ValueError("paired=True needs as many betas as states")
+        log_Z = self.get_log_partition_function(betas)
+        # Thermal probabilities in the eigenbasis, shape (len(betas), 2^N)
+        probabilities = np.exp(-np.outer(betas, eigenvalues) - log_Z[:, None])
+        shape = (len(rho_list),) if paired else (len(rho_list), len(betas))
+        result = {metric: np.zeros(shape) for metric in metrics}
+        for rho_index, rho in enumerate(rho_list):
+            # Betas compared with this rho
+            beta_indices = [rho_index] if paired else slice(None)
+            result_index = rho_index if paired else (rho_index, slice(None))
+            if isinstance(rho, DensityMatrix):
+                rho = rho.data
+            rho_eigenbasis = eigenvectors.conj().T @ np.asarray(rho) @ eigenvectors
+            if "relative_entropy" in metrics:
+                rho_eigenvalues = np.linalg.eigvalsh(rho_eigenbasis)
+                rho_eigenvalues = rho_eigenvalues[rho_eigenvalues > 1e-15]
+                entropy = -np.sum(rho_eigenvalues * np.log(rho_eigenvalues))
+                energy = np.real(np.sum(eigenvalues * np.diag(rho_eigenbasis)))
+                result["relative_entropy"][result_index] = (
+                    -entropy + betas[beta_indices] * energy + log_Z[beta_indices]
+                )
+            if "trace_distance" in metrics:
+                difference = rho_eigenbasis[None, :, :] - probabilities[beta_indices][
+                    :, :, None
+                ] * np.eye(len(eigenvalues))
+                result["trace_distance"][result_index] = 0.5 * np.sum(
+                    np.abs(np.linalg.eigvalsh(difference)), axis=1
+                )
+            if "fidelity" in metrics:
+                sqrt_p = np.sqrt(probabilities[beta_indices])
+                product = sqrt_p[:, :, None] * rho_eigenbasis[None, :, :] * sqrt_p[:, None, :]
+                product_eigenvalues = np.clip(np.linalg.eigvalsh(product), 0.0, None)
+                result["fidelity"][result_index] = (
+                    np.sum(np.sqrt(product_eigenvalues), axis=1) ** 2
+                )
+        return result
 
     def get_sqrt(self, op):  # Not working
         eigenvalues, eigenstates = self.diagonalize(op)
@@ -134,3 +509,232 @@ class LMG_hamiltonian:
                 if p_first_i != 0:
                     S += p_first_i * (np.log(p_first_i) - np.log(p_second_i))
         return S
+
+
+class LMG_hamiltonian(spin_hamiltonian):
+    r"""
+    LMG Hamiltonian :math:`H = -B \sum_i Z_i - \frac{1}{N} \sum_{i<j} (X_i X_j + \gamma Y_i Y_j)`.
+    """
+
+    def __init__(self, N: int, gy: float, B: float):
+        self.gy = gy
+        self.B = B
+        super().__init__(N, Jxx=-1.0 / N, Jyy=-gy / N, hz=-B)
+
+
+class LMG_dicke_hamiltonian:
+    r"""
+    LMG Hamiltonian in the collective-spin (Dicke) representation.
+
+    Since the LMG model is permutation-symmetric, it can be rewritten with the total spin
+    operators :math:`S_a = \frac{1}{2}\sum_i \sigma^a_i` as
+
+    .. math::
+
+        H = -2B S_z - \frac{2}{N}(S_x^2 + \gamma S_y^2) + \frac{1 + \gamma}{2}
+
+    which is block diagonal in the total spin sectors :math:`S = N/2, N/2 - 1, \dots`.
+    Each sector has dimension :math:`2S + 1` and appears :math:`d_S` times in the
+    :math:`2^N`-dimensional Hilbert space. Inside a sector, H only couples :math:`m` to
+    :math:`m \pm 2`, so it further splits into two tridiagonal blocks (the parity sectors).
+    This allows exact ground states, partition functions and thermal averages for N in the
+    thousands.
+
+    Args:
+        N: Number of spins.
+        gy: :math:`\gamma` of the LMG Hamiltonian.
+        B: Magnetic field intensity.
+    """
+
+    def __init__(self, N: int, gy: float, B: float):
+        self.N = N
+        self.gy = gy
+        self.B = B
+        self.spin_sectors = [N / 2.0 - k for k in range(N // 2 + 1)]
+        self.spectrum = {}
+
+    def get_spin_sectors(self):
+        r"""Returns the list of total spin values S = N/2, N/2 - 1, ..., (0 or 1/2)."""
+        return self.spin_sectors
+
+    def get_log_multiplicity(self, S):
+        r"""Returns the logarithm of the degeneracy :math:`d_S` of the sector with total spin S.
+
+        :math:`d_S = \binom{N}{N/2 - S} - \binom{N}{N/2 - S - 1}`, computed in log scale
+        since it overflows for large N.
+        """
+        k = int(round(self.N / 2.0 - S))
+        log_binom = gammaln(self.N + 1) - gammaln(k + 1) - gammaln(self.N - k + 1)
+        if k == 0:
+            return log_binom
+        # d_S = C(N, k) * (N - 2k + 1) / (N - k + 1)
+        return log_binom + np.log(self.N - 2 * k + 1) - np.log(self.N - k + 1)
+
+    def get_multiplicity(self, S):
+        return np.exp(self.get_log_multiplicity(S))
+
+    def get_m_list(self, S):
+        r"""Returns the :math:`S_z` eigenvalues m = S, S - 1, ..., -S labelling the sector basis."""
+        return S - np.arange(int(round(2 * S)) + 1)
+
+    def get_collective_operator(self, name: str, S):
+        r"""Returns a collective operator restricted to the sector S in the :math:`|S, m\rangle` basis.
+
+        Args:
+            name: One of "Sx", "Sy", "Sz", "Sx2", "Sy2", "Sz2", "H".
+            S: Total spin of the sector.
+
+        Returns:
+            Dense (2S + 1) x (2S + 1) matrix.
+        """
+        m = self.get_m_list(S)
+        # S_+|S, m> = sqrt(S(S+1) - m(m+1)) |S, m+1>, the basis is ordered with decreasing m
+        s_plus = np.diag(np.sqrt(S * (S + 1) - m[1:] * (m[1:] + 1)), k=1).astype(complex)
+        s_minus = s_plus.conj().T
+        if name == "Sx":
+            return (s_plus + s_minus) / 2.0
+        elif name == "Sy":
+            return (s_plus - s_minus) / 2.0j
+        elif name == "Sz":
+            return np.diag(m).astype(complex)
+        elif name == "Sx2":
+            sx = csr_matrix((s_plus + s_minus) / 2.0)
+            return (sx @ sx).toarray()
+        elif name == "Sy2":
+            sy = csr_matrix((s_plus - s_minus) / 2.0j)
+            return (sy @ sy).toarray()
+        elif name == "Sz2":
+            return np.diag(m ** 2).astype(complex)
+        elif name == "H":
+            return self.get_sector_matrix(S).astype(complex)
+        raise ValueError("Unknown collective operator {}".format(name))
+
+    def get_sector_matrix(self, S):
+        r"""Returns the dense Hamiltonian restricted to the sector S in the :math:`|S, m\rangle` basis."""
+        m = self.get_m_list(S)
+        diagonal, off_diagonal = self.sector_coefficients(S, m)
+        H_S = np.diag(diagonal)
+        H_S += np.diag(off_diagonal, k=2) + np.diag(off_diagonal, k=-2)
+        return H_S
+
+    def sector_coefficients(self, S, m):
+        r"""Returns the diagonal and the :math:`m \rightarrow m - 2` couplings of H in the sector S."""
+        diagonal = (
+            -2.0 * self.B * m
+            - (1.0 + self.gy) / self.N * (S * (S + 1) - m ** 2)
+            + (1.0 + self.gy) / 2.0
+        )
+        # <S, m-2| S_-^2 |S, m>, the coefficient in front of (S_+^2 + S_-^2) is -(1 - gy)/(2N)
+        m_high = m[:-2]
+        off_diagonal = (
+            -(1.0 - self.gy)
+            / (2.0 * self.N)
+            * np.sqrt((S + m_high) * (S - m_high + 1) * (S + m_high - 1) * (S - m_high + 2))
+        )
+        return diagonal, off_diagonal
+
+    def get_tridiagonal_blocks(self, S):
+        r"""Returns the two tridiagonal blocks of the sector S.
+
+        Returns:
+            List of (diagonal, off_diagonal, positions) for the blocks with even and odd
+            :math:`S - m`, where positions are the indices of the block in the sector basis.
+        """
+        m = self.get_m_list(S)
+        diagonal, off_diagonal = self.sector_coefficients(S, m)
+        blocks = []
+        for start in (0, 1):
+            positions = np.arange(start, len(m), 2)
+            blocks.append((diagonal[positions], off_diagonal[positions[:-1]], positions))
+        return blocks
+
+    def diagonalize_sector(self, S, eigenvectors=False):
+        r"""Diagonalizes the sector S through Its tridiagonal blocks.
+
+        Args:
+            S: Total spin of the sector.
+            eigenvectors: If True, eigenvectors in the :math:`|S, m\rangle` basis are computed too.
+
+        Returns:
+            Sorted eigenvalues and, if required, eigenvectors as columns.
+        """
+        eigenvalues = []
+        eigenstates = []
+        dimension = int(round(2 * S)) + 1
+        for diagonal, off_diagonal, positions in self.get_tridiagonal_blocks(S):
+            if len(diagonal) == 0:
+                continue
+            if eigenvectors:
+                w, v = eigh_tridiagonal(diagonal, off_diagonal)
+                full_v = np.zeros((dimension, len(w)))
+                full_v[positions, :] = v
+                eigenstates.append(full_v)
+            else:
+                w = eigh_tridiagonal(diagonal, off_diagonal, eigvals_only=True)
+            eigenvalues.append(w)
+        eigenvalues = np.concatenate(eigenvalues)
+        order = np.argsort(eigenvalues)
+        if eigenvectors:
+            return eigenvalues[order], np.hstack(eigenstates)[:, order]
+        return eigenvalues[order]
+
+    def get_spectrum(self):
+        r"""Returns the eigenvalues sector by sector, cached after the first call.
+
+        Returns:
+            Dictionary with S as keys and (eigenvalues, log multiplicity) as values.
+        """
+        for S in self.spin_sectors:
+            if S not in self.spectrum:
+                self.spectrum[S] = (self.diagonalize_sector(S), self.get_log_multiplicity(S))
+        return self.spectrum
+
+    def get_ground_state(self):
+        r"""Returns the ground state energy, the total spin of Its sector and the eigenvector in the :math:`|S, m\rangle` basis."""
+        spectrum = self.get_spectrum()
+        S_ground = min(self.spin_sectors, key=lambda S: spectrum[S][0][0])
+        w, v = self.diagonalize_sector(S_ground, eigenvectors=True)
+        return w[0], S_ground, v[:, 0]
+
+    def get_log_partition_function(self, beta):
+        r"""Returns :math:`\log Z(\beta)`, with :math:`Z = \sum_S d_S \sum_n e^{-\beta E_{S,n}}`."""
+        spectrum = self.get_spectrum()
+        log_weights = np.concatenate(
+            [spectrum[S][1] - beta * spectrum[S][0] for S in self.spin_sectors]
+        )
+        return logsumexp(log_weights)
+
+    def get_partition_function(self, beta):
+        return np.exp(self.get_log_partition_function(beta))
+
+    def thermal_average(self, op, beta, cutoff=1e-16):
+        r"""Computes the thermal average of a collective operator.
+
+        Eigenvectors are computed sector by sector and never stored, sectors whose total
+        Boltzmann weight is below cutoff are skipped.
+
+        Args:
+            op: Name of a collective operator (see get_collective_operator) or a function
+                returning Its (2S + 1) x (2S + 1) matrix for a given S.
+            beta: Inverse temperature.
+            cutoff: Relative weight under which a sector is neglected.
+
+        Returns:
+            :math:`\mathrm{Tr}[O e^{-\beta H}] / Z`.
+        """
+        spectrum = self.get_spectrum()
+        log_Z = self.get_log_partition_function(beta)
+        average = 0.0
+        for S in self.spin_sectors:
+            w, log_multiplicity = spectrum[S]
+            weights = np.exp(log_multiplicity - beta * w - log_Z)
+            if np.sum(weights) < cutoff:
+                continue
+            if op == "H":
+                average += np.sum(weights * w)
+                continue
+            w, v = self.diagonalize_sector(S, eigenvectors=True)
+            op_S = self.get_collective_operator(op, S) if isinstance(op, str) else op(S)
+            # Collective operators are banded in the |S, m> basis
+            average += np.sum(weights * np.sum(v.conj() * (csr_matrix(op_S) @ v), axis=0))
+        return average
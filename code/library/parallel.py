@@ -0,0 +1,110 @@
+# -*- coding: utf-8 -*-
+r"""
+Functions to run the MHETS optimizations of different betas on a pool of processes.
+
+With strategy A0 every beta starts from Its own initial guess, so the single-beta
+optimizations are independent. Each worker rebuilds Its own MHETS_instance from the
+optimization_options (nothing stateful is shared between processes) and the results are
+merged in the multi_beta_result layout of MHETS_instance.multi_beta_optimization_from_scratch.
+
+On platforms that spawn processes (Windows, macOS) the caller script must be guarded by
+if __name__ == "__main__".
+
+
+
+Created on Mon Oct 19 16:05:44 2026
+
+@author: DeWitt
+"""
+import os
+import time
+from multiprocessing import Pool
+
+
+from library import setup
+from library.MHETS import MHETS_instance, append_single_beta_result
+
+
+def build_instance(H, optimization_options, backend=None):
+    r"""Rebuilds the MHETS_instance described by optimization_options."""
+    ancilla_ansatz, system_ansatz = setup.setup_ansatz(H.N, optimization_options)
+    return MHETS_instance(
+        H=H,
+        ancilla_ansatz=ancilla_ansatz,
+        system_ansatz=system_ansatz,
+        optimization_options=optimization_options,
+        flag=optimization_options["flag"],
+        backend=backend,
+        estimator=optimization_options.get("estimator", "tomography"),
+        recorder_options=optimization_options.get("recorder_options", {}),
+        cache_options=optimization_options.get("cache_options", None),
+        seed=optimization_options.get("seed", None),
+    )
+
+
+def single_beta_optimization(task):
+    r"""Worker: optimizes one beta.
+
+    Args:
+        task: Tuple (H, optimization_options, backend, beta, initial_parameter_list_guess).
+
+    Returns:
+        Result of MHETS_instance.optimize, with the pid of the worker and Its total time
+        (instance setup included).
+    """
+    H, optimization_options, backend, beta, initial_parameter_list_guess = task
+    worker_start = time.time()
+    mhets = build_instance(H, optimization_options, backend=backend)
+    result = mhets.optimize(
+        beta=beta,
+        initial_parameter_list_guess=initial_parameter_list_guess,
+        maxiter=optimization_options["maxiter"],
+        optimizer=optimization_options["optimizer"],
+        tol=optimization_options["tol"],
+        shots=optimization_options["shots"],
+    )
+    result["worker"] = os.getpid()
+    result["Time worker"] = time.time() - worker_start
+    return result
+
+
+def multi_beta_optimization_parallel(
+    H, betas, optimization_options, backend=None, processes=None
+):
+    r"""Parallel version of MHETS_instance.multi_beta_optimization_from_scratch (strategy A0).
+
+    Args:
+        H: Hamiltonian.
+        betas: List of inverse temperatures.
+        optimization_options: Dictionary made by setup.setup_optimization_options; Its
+            "initial_parameter_list" has one guess (or None) per beta.
+        backend: Backend of the instances, it must be picklable (None for statevector).
+        processes: Number of processes (default: min(number of betas, number of CPUs)).
+
+    Returns:
+        multi_beta_result dictionary, in the order of betas.
+    """
+    if processes is None:
+        processes = min(len(betas), os.cpu_count())
+    tasks = [
+        (
+            H,
+            optimization_options,
+            backend,
+            beta,
+            optimization_options["initial_parameter_list"][index],
+        )
+        for index, beta in enumerate(betas)
+    ]
+    total_start = time.time()
+    with Pool(processes) as pool:
+        results = pool.map(single_beta_optimization, tasks, chunksize=1)
+    multi_beta_result = {
+        "betas": [],
+        "optimization_options": optimization_options,
+        "backend": backend,
+    }
+    for beta, result in zip(betas, results):
+        append_single_beta_result(multi_beta_result, beta, result)
+    print("Total parallel time", time.time() - total_start)
+    return multi_beta_result
@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+r"""
+Functions to measure Pauli observables on sampling backends with few circuits.
+
+The terms of an observable are partitioned in qubit-wise commuting groups, which are
+measured together in the same product basis. The basis-change circuits only depend on the
+basis label (e.g. "XXI"), not on the coefficients, so they are built once and cached for
+all the cost evaluations, betas and Hamiltonians of a session. The LMG Hamiltonian gives
+three groups (Z fields, XX and YY couplings) for any N.
+
+
+
+Created on Mon Oct 19 19:02:40 2026
+
+@author: DeWitt
+"""
+import numpy as np
+from qiskit.circuit import QuantumCircuit
+
+
+# Basis-change circuits, keyed by basis label
+basis_change_cache = {}
+
+
+def measurement_basis(group):
+    r"""Returns the product basis of a qubit-wise commuting group as label, in qiskit order
+    (qubit 0 is the last character). "I" marks qubits not measured by any term."""
+    x = np.any(group.paulis.x, axis=0)
+    z = np.any(group.paulis.z, axis=0)
+    label = ""
+    for qubit in range(group.num_qubits):
+        if x[qubit] and z[qubit]:
+            label = "Y" + label
+        elif x[qubit]:
+            label = "X" + label
+        elif z[qubit]:
+            label = "Z" + label
+        else:
+            label = "I" + label
+    return label
+
+
+def group_observable(pauli):
+    r"""Partitions the terms of a SparsePauliOp in qubit-wise commuting groups.
+
+    Returns:
+        List of SparsePauliOp, sorted by measurement basis.
+    """
+    return sorted(pauli.group_commuting(qubit_wise=True), key=measurement_basis)
+
+
+def get_basis_change_circuit(basis: str):
+    r"""Returns the (cached) circuit that rotates the product basis into the computational one:
+    H for X, S^dagger H for Y.
+
+    Args:
+        basis: Basis label, as returned by measurement_basis.
+    """
+    if basis not in basis_change_cache:
+        circuit = QuantumCircuit(len(basis))
+        for qubit, pauli in enumerate(reversed(basis)):
+            if pauli == "Y":
+                circuit.sdg(qubit)
+                circuit.h(qubit)
+            elif pauli == "X":
+                circuit.h(qubit)
+        basis_change_cache[basis] = circuit
+    return basis_change_cache[basis]
+
+
+def measurement_circuits(circuit, groups, qubits=None):
+    r"""Returns one measured copy of circuit for each group.
+
+    Args:
+        circuit: Circuit preparing the state.
+        groups: List of qubit-wise commuting groups.
+        qubits: Qubits of circuit the groups act on (default: the first ones).
+
+    Returns:
+        List of circuits, with measure_all on every qubit.
+    """
+    circuits = []
+    for group in groups:
+        if qubits is None:
+            qubits = range(group.num_qubits)
+        measured_circuit = circuit.compose(
+            get_basis_change_circuit(measurement_basis(group)), qubits
+        )
+        measured_circuit.measure_all()
+        circuits.append(measured_circuit)
+    return circuits
@@ -10,7 +10,6 @@ Created on Tue Dec 28 09:34:12 2023
 """
 from qiskit.quantum_info import (
     Statevector,
-    state_fidelity,
     partial_trace,
     SparsePauliOp,
 )
@@ -19,6 +18,7 @@ import matplotlib.pyplot as plt
 
 
 from library.operator_creation import LMG_hamiltonian
+from library import shadows
 
 
 def plot_thermal_average(QMETTS_result, numerical_final_beta=7.0, numerical_beta_points=100):
@@ -251,9 +251,10 @@ def plot_fidelity(beta_list, rho_s_list, H, backend=None):
     plt.ylabel("Fidelity")
     plt.xlabel("beta")
 
-    fidelity = []
-    for index in range(len(beta_list)):
-        fidelity.append(state_fidelity(rho_s_list[index], H.get_thermal_state(beta_list[index])))
+    # Each rho_s is compared only with the thermal state of Its own beta
+    fidelity = H.thermal_state_metrics(
+        rho_s_list, beta_list, metrics=("fidelity",), paired=True
+    )["fidelity"]
     plt.plot(beta_list, np.ones(len(beta_list)), color="black", ls="dotted")
     if backend is None:
         gylabel = "$\gamma$ = {gy:.1f}, B = {B:.1f}"
@@ -297,14 +298,9 @@ def plot_rel_entropy(beta_list, rho_s_list, H, backend=None):
     plt.ylabel("S(MHETS_state||num_state)")
     plt.xlabel("beta")
 
-    rel_entropy = []
-    for index in range(len(beta_list)):
-        rel_entropy.append(
-            H.relative_entropy(
-                rho_s_list[index].to_operator().to_matrix(),
-                H.get_thermal_state(beta_list[index]),
-            )
-        )
+    rel_entropy = H.thermal_state_metrics(
+        rho_s_list, beta_list, metrics=("relative_entropy",), paired=True
+    )["relative_entropy"]
     plt.plot(beta_list, np.zeros(len(beta_list)), color="black", ls="dotted")
     if backend is None:
         gylabel = "$\gamma$ = {gy:.1f}, B = {B:.1f}"
@@ -355,7 +351,9 @@ def plot_parity(
     num_parity = []
     P = SparsePauliOp(N * "Z", 1.0)
     for beta in num_beta:
-        num_parity.append(H.thermal_average(P.to_matrix(), beta))
+        # <P> = (Z_+ - Z_-) / (Z_+ + Z_-) from the parity sectors of H
+        Z = H.get_sector_partition_functions(beta)
+        num_parity.append((Z[1] - Z[-1]) / (Z[1] + Z[-1]))
     MHETS_parity = []
     for index in range(len(beta_list)):
         MHETS_parity.append(rho_s_list[index].expectation_value(P.to_operator()))
@@ -465,11 +463,13 @@ def plot_MHETS_shots(multi_data, betas, H):
         )
     )
 
+    # Exact Helmoltz energies for all the betas at once
+    exact_helm_energy = H.cost_function(np.asarray(betas)) / np.asarray(betas)
     for beta in betas:
         maxiter_list = range(1, multi_data[0]["optimization_options"]["maxiter"] + 1)
         axs[np.where(betas == beta)[0][0]].plot(
             maxiter_list,
-            [H.cost_function(beta) / beta for _ in range(len(maxiter_list))],
+            np.full(len(maxiter_list), exact_helm_energy[np.where(betas == beta)[0][0]]),
             color="black",
             ls="dotted",
             label="Numerical value for beta = {}".format(beta),
@@ -484,7 +484,7 @@ def plot_MHETS_shots(multi_data, betas, H):
             ):
                 n_iterations += 51  # SPSA takes some iterations for calibration
             axs[np.where(betas == beta)[0][0]].plot(
-                range(1, n_iterations),
+                take_evaluations(multi_data[index], beta, range(1, n_iterations)),
                 take_helm_energy(multi_data[index], beta, H),
                 color=color_list[index],
                 label=gylabel.format(multi_data[index]["optimization_options"]["shots"]),
@@ -525,7 +525,11 @@ def plot_MHETS_shots_fidelity(multi_data, betas, H):
         for index in range(len(multi_data)):
             beta_index = multi_data[index]["betas"].index(beta)
             axs[np.where(betas == beta)[0][0]].plot(
-                range(1, multi_data[index]["n_eval"][beta_index] + 1),
+                take_evaluations(
+                    multi_data[index],
+                    beta,
+                    range(1, multi_data[index]["n_eval"][beta_index] + 1),
+                ),
                 take_QST_fidelity(multi_data[index], beta, H),
                 color=color_list[index],
                 label=gylabel.format(multi_data[index]["optimization_options"]["shots"]),
@@ -538,10 +542,22 @@ def plot_MHETS_shots_fidelity(multi_data, betas, H):
         ax.legend()  # Show legend
 
 
+def take_evaluations(multi_beta_result, beta, old_evaluations):
+    r"""Returns the evaluation numbers (from 1) of the recorded data. Data written before the
+    cost_recorder have no counter, so old_evaluations is returned for them."""
+    beta_index = multi_beta_result["betas"].index(beta)
+    callback_data = multi_beta_result["callback_data"][beta_index]
+    if isinstance(callback_data, dict):
+        return callback_data["counter"] + 1
+    return old_evaluations
+
+
 def take_QST_fidelity(multi_beta_result, beta, H):
     QST_fidelity_list = []
 
     beta_index = multi_beta_result["betas"].index(beta)
+    if isinstance(multi_beta_result["callback_data"][beta_index], dict):
+        return multi_beta_result["callback_data"][beta_index]["fidelity"]
     for data in multi_beta_result["callback_data"][beta_index]:
         QST_fidelity_list.append(data.analysis_results("state_fidelity").value)
     return QST_fidelity_list
@@ -551,6 +567,9 @@ def take_helm_energy(multi_beta_result, beta, H):
     helm_energy_list = []
 
     beta_index = multi_beta_result["betas"].index(beta)
+    if isinstance(multi_beta_result["callback_data"][beta_index], dict):
+        # cost_recorder data: F = beta * E - S
+        return multi_beta_result["callback_data"][beta_index]["F"] / beta
     for data in multi_beta_result["callback_data"][beta_index]:
         rho = data.analysis_results("state").value
         prob_ancilla = rho.probabilities(range(0, H.N))
@@ -565,3 +584,30 @@ def take_helm_energy(multi_beta_result, beta, H):
 
         helm_energy_list.append(np.real(system_exp_value - (1.0 / beta) * entropy))
     return helm_energy_list
+
+
+def take_shadow_estimates(multi_beta_result, beta, H):
+    r"""Offline estimates from the classical shadows stored by the recorder (estimator="shadow").
+
+    Returns:
+        Dictionary with the evaluation numbers (from 1), ancilla populations, system parity and
+        fidelity of the system state with the exact thermal state of beta.
+    """
+    beta_index = multi_beta_result["betas"].index(beta)
+    estimates = {"evaluations": [], "populations": [], "parity": [], "fidelity": []}
+    for counter, snapshots in multi_beta_result["callback_data"][beta_index]["heavy"]:
+        system_qubits = range(snapshots["num_qubits"] - H.N, snapshots["num_qubits"])
+        rho_S = shadows.project_density_matrix(
+            shadows.density_matrix_estimate(snapshots, qubits=system_qubits)
+        )
+        estimates["evaluations"].append(counter + 1)
+        estimates["populations"].append(
+            shadows.population_estimate(
+                snapshots, qubits=range(snapshots["num_qubits"] - H.N)
+            )
+        )
+        estimates["parity"].append(shadows.parity_estimate(snapshots, qubits=system_qubits)[0])
+        estimates["fidelity"].append(
+            H.thermal_state_metrics([rho_S], [beta], metrics=("fidelity",))["fidelity"][0, 0]
+        )
+    return estimates
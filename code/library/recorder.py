@@ -0,0 +1,121 @@
+# -*- coding: utf-8 -*-
+r"""
+Class to record the cost function evaluations of a single optimization, with bounded memory.
+
+Numeric records (F, energy, entropy, fidelity, variances, time) are written in preallocated arrays.
+When the arrays are full, every other record is dropped and the decimation doubles, so the
+memory stays the same for any maxiter and the records still span the whole optimization.
+Heavy objects (e.g. ExperimentData of the tomography) go in a ring buffer of fixed length.
+
+
+
+Created on Mon Oct 19 17:31:09 2026
+
+@author: DeWitt
+"""
+import time
+import numpy as np
+from collections import deque
+
+
+class cost_recorder:
+    r"""Bounded record of the cost function evaluations of one optimization.
+
+    Args:
+        size: Number of preallocated numeric records (rounded up to an even number).
+        decimation: Initial decimation, one evaluation out of decimation is recorded.
+        heavy_size: Maximum number of heavy objects kept (the oldest are dropped).
+        heavy_decimation: One heavy object out of heavy_decimation evaluations is kept.
+    """
+
+    fields = [
+        "counter",
+        "F",
+        "energy",
+        "entropy",
+        "fidelity",
+        "energy_variance",
+        "entropy_variance",
+        "time",
+    ]
+
+    def __init__(self, size=10000, decimation=1, heavy_size=100, heavy_decimation=10):
+        self.size = size + size % 2
+        self.decimation = decimation
+        self.heavy_decimation = heavy_decimation
+        self.records = {field: np.full(self.size, np.nan) for field in self.fields}
+        self.length = 0
+        self.counter = 0
+        self.heavy = deque(maxlen=heavy_size)
+        self.start = time.time()
+
+    def get_counter(self):
+        return self.counter
+
+    def record(
+        self,
+        F,
+        energy=np.nan,
+        entropy=np.nan,
+        fidelity=np.nan,
+        energy_variance=np.nan,
+        entropy_variance=np.nan,
+        heavy=None,
+    ):
+        r"""Records one evaluation of the cost function."""
+        if self.counter % self.decimation == 0:
+            if self.length == self.size:
+                self.compress()
+            for field, value in zip(
+                self.fields,
+                [
+                    self.counter,
+                    F,
+                    energy,
+                    entropy,
+                    fidelity,
+                    energy_variance,
+                    entropy_variance,
+                    time.time() - self.start,
+                ],
+            ):
+                self.records[field][self.length] = value
+            self.length += 1
+        if heavy is not None and self.counter % self.heavy_decimation == 0:
+            self.heavy.append((self.counter, heavy))
+        self.counter += 1
+
+    def compress(self):
+        r"""Keeps every other record and doubles the decimation."""
+        for field in self.fields:
+            self.records[field][: self.size // 2] = self.records[field][0 : self.size : 2]
+            self.records[field][self.size // 2 :] = np.nan
+        self.length = self.size // 2
+        self.decimation *= 2
+
+    def get_data(self):
+        r"""Returns the records as dictionary of arrays (with the counter as int), the final
+        decimation and the heavy objects as list of (counter, object)."""
+        data = {field: self.records[field][: self.length].copy() for field in self.fields}
+        data["counter"] = data["counter"].astype(int)
+        data["decimation"] = self.decimation
+        data["n_eval"] = self.counter
+        data["heavy"] = list(self.heavy)
+        return data
+
+
+def merge_data(old_data, new_data):
+    r"""Joins the data of two recorders of consecutive optimizations (e.g. a restart)
+    into the data of a single one."""
+    data = {}
+    for field in cost_recorder.fields:
+        data[field] = np.concatenate([old_data[field], new_data[field]])
+    data["counter"][len(old_data["counter"]) :] += old_data["n_eval"]
+    if len(old_data["time"]) > 0:
+        data["time"][len(old_data["time"]) :] += old_data["time"][-1]
+    data["decimation"] = max(old_data["decimation"], new_data["decimation"])
+    data["n_eval"] = old_data["n_eval"] + new_data["n_eval"]
+    data["heavy"] = old_data["heavy"] + [
+        (counter + old_data["n_eval"], heavy) for counter, heavy in new_data["heavy"]
+    ]
+    return data
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+r"""
+Collection of functions to store on disk the exact reference data of an LMG Hamiltonian
+(spectrum and thermal tables on a dense beta grid), so that plotting and analysis scripts
+don't recompute them in every session.
+
+Each Hamiltonian has Its own directory of .npy files, which are loaded memory-mapped and
+can be shared by different scripts and processes. The directory name is lossless (repr of
+gy and B for the LMG model, hash of the Pauli terms otherwise) and the full description of
+the Hamiltonian is stored with the data and checked on load.
+
+
+
+Created on Mon Oct 19 11:02:18 2026
+
+@author: DeWitt
+"""
+import os
+import hashlib
+import numpy as np
+
+
+from library.operator_creation import thermal_table
+
+
+SECTOR_NAMES = {1: "even", -1: "odd"}
+
+
+def reference_description(H):
+    r"""Returns a string that identifies H exactly: N and the sorted Pauli terms with the repr of
+    Their coefficients."""
+    pauli = H.get_pauli().simplify()
+    terms = sorted(zip(pauli.paulis.to_labels(), pauli.coeffs))
+    return "N={};".format(H.N) + ";".join(
+        "{}:{!r}".format(label, complex(coeff)) for label, coeff in terms
+    )
+
+
+def reference_name(H):
+    r"""Returns the directory name of H, "LMG_{N}at_gy{gy!r}_B{B!r}" for the LMG model, a hash of
+    reference_description otherwise."""
+    if getattr(H, "gy", None) is not None and getattr(H, "B", None) is not None:
+        return "LMG_{}at_gy{!r}_B{!r}".format(H.N, float(H.gy), float(H.B))
+    return "spin_{}at_{}".format(
+        H.N, hashlib.sha1(reference_description(H).encode()).hexdigest()[:16]
+    )
+
+
+def save_array(directory, name, array):
+    r"""Writes an array through a temporary file and a rename, so readers never see partial files."""
+    temporary_file = os.path.join(directory, "{}.{}.tmp.npy".format(name, os.getpid()))
+    np.save(temporary_file, array)
+    os.replace(temporary_file, os.path.join(directory, name + ".npy"))
+
+
+def save_reference(H, path="./reference_data/", betas=None, eigenvectors=True):
+    r"""Computes and writes the reference data of H.
+
+    Args:
+        H: LMG_hamiltonian.
+        path: Directory of the reference store.
+        betas: Beta grid of the thermal tables (default: 1001 points in [0, 10]).
+        eigenvectors: If False, only eigenvalues and thermal tables are stored.
+
+    Returns:
+        Directory where data are stored.
+    """
+    if betas is None:
+        betas = np.linspace(0.0, 10.0, 1001)
+    directory = os.path.join(path, reference_name(H))
+    os.makedirs(directory, exist_ok=True)
+    save_array(directory, "description", np.array(reference_description(H)))
+    for sector, (w, v) in H.get_parity_spectrum().items():
+        save_array(directory, "eigenvalues_" + SECTOR_NAMES[sector], w)
+        if eigenvectors:
+            save_array(directory, "eigenvectors_" + SECTOR_NAMES[sector], v)
+    eigenvalues = H.get_eigenvalues()
+    save_array(directory, "eigenvalues", eigenvalues)
+    for key, array in thermal_table(eigenvalues, betas).items():
+        save_array(directory, key, array)
+    return directory
+
+
+def load_reference(H, path="./reference_data/", mmap_mode="r"):
+    r"""Loads the reference data of H, memory-mapped.
+
+    Returns:
+        Dictionary of arrays, or None if H is not in the store (or the stored data belong to
+        another Hamiltonian).
+    """
+    directory = os.path.join(path, reference_name(H))
+    if not os.path.isfile(os.path.join(directory, "log_partition_function.npy")):
+        return None
+    description_file = os.path.join(directory, "description.npy")
+    if not os.path.isfile(description_file) or str(np.load(description_file)) != (
+        reference_description(H)
+    ):
+        print("Warning!!! Reference data in {} do not match H, ignored".format(directory))
+        return None
+    reference = {}
+    for file_name in os.listdir(directory):
+        if (
+            file_name.endswith(".npy")
+            and ".tmp" not in file_name
+            and file_name != "description.npy"
+        ):
+            reference[file_name[: -len(".npy")]] = np.load(
+                os.path.join(directory, file_name), mmap_mode=mmap_mode
+            )
+    return reference
+
+
+def get_reference(H, path="./reference_data/", betas=None, eigenvectors=True):
+    r"""Loads the reference data of H, computing and storing them first if missing."""
+    reference = load_reference(H, path=path)
+    if reference is None or (eigenvectors and "eigenvectors_even" not in reference):
+        save_reference(H, path=path, betas=betas, eigenvectors=eigenvectors)
+        reference = load_reference(H, path=path)
+    return reference
+
+
+def attach_reference(H, path="./reference_data/", betas=None):
+    r"""Seeds the cached spectrum of H with the stored one, so every exact quantity computed by
+    H (thermal states, averages, metrics) skips the diagonalization.
+
+    Returns:
+        The reference data dictionary.
+    """
+    reference = get_reference(H, path=path, betas=betas, eigenvectors=True)
+    H.parity_spectrum = {
+        sector: (reference["eigenvalues_" + name], reference["eigenvectors_" + name])
+        for sector, name in SECTOR_NAMES.items()
+        if "eigenvalues_" + name in reference
+    }
+    return reference
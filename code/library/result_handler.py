@@ -7,6 +7,11 @@ Created on Tue Dec 14 12:04:17 2023
 
 @author: DeWitt
 """
+import os
+import pickle
+import shutil
+
+
 from qiskit.quantum_info import Statevector
 
 
@@ -91,6 +96,100 @@ class QMETTS_results:
         return taus, evolved_state_dict
 
 
+
+class MHETS_store:
+    r"""Per-beta store of the MHETS results of a run, so that an interrupted sweep can resume.
+
+    Each completed beta is written to Its own pickle in directory through a temporary file
+    and a rename, so a crash never leaves a partial file behind: a beta is either complete
+    or missing. The file name holds the exact repr of beta.
+
+    The optimization options of the run (without the per-beta initial guesses) are stored
+    too: a store made with different options (optimizer, maxiter, ansatzes, estimator, ...)
+    holds stale betas, so It is cleared with a warning instead of being resumed.
+
+    Args:
+        directory: Directory of the run (e.g. the final file name without extension + "_temp/").
+        optimization_options: Options of the run, see setup.setup_optimization_options.
+    """
+
+    def __init__(self, directory: str, optimization_options: dict = None):
+        self.directory = directory
+        os.makedirs(self.directory, exist_ok=True)
+        self.options = {}
+        if optimization_options is not None:
+            self.options = {
+                key: value
+                for key, value in optimization_options.items()
+                if key != "initial_parameter_list"
+            }
+        options_file = os.path.join(self.directory, "options.pickle")
+        if os.path.isfile(options_file):
+            with open(options_file, "rb") as f:
+                stored_options = pickle.load(f)
+            if not self.options_match(stored_options):
+                print(
+                    "Warning!!! Store {} made with different optimization options, "
+                    "its betas are discarded".format(self.directory)
+                )
+                self.clear_betas()
+        elif len(self.get_betas()) > 0:
+            print(
+                "Warning!!! Store {} has no optimization options, "
+                "its betas are discarded".format(self.directory)
+            )
+            self.clear_betas()
+        self.write(options_file, self.options)
+
+    def options_match(self, stored_options: dict):
+        r"""True if stored_options are the options of this run (values compared by repr,
+        so that arrays and floats compare exactly)."""
+        if set(stored_options.keys()) != set(self.options.keys()):
+            return False
+        return all(repr(stored_options[key]) == repr(self.options[key]) for key in self.options)
+
+    def write(self, file_name, data):
+        r"""Pickles data to file_name through a temporary file and a rename."""
+        temporary_file = "{}.{}.tmp".format(file_name, os.getpid())
+        with open(temporary_file, "wb") as f:
+            pickle.dump(data, f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temporary_file, file_name)
+
+    def beta_file(self, beta):
+        return os.path.join(self.directory, "beta_{!r}.pickle".format(float(beta)))
+
+    def has_beta(self, beta):
+        return os.path.isfile(self.beta_file(beta))
+
+    def save(self, beta, result: dict):
+        r"""Writes the result of one beta atomically."""
+        self.write(self.beta_file(beta), result)
+
+    def load(self, beta):
+        r"""Returns the stored result of beta, or None if beta is not complete."""
+        if not self.has_beta(beta):
+            return None
+        with open(self.beta_file(beta), "rb") as f:
+            return pickle.load(f)
+
+    def get_betas(self):
+        r"""Returns the sorted list of the completed betas."""
+        betas = []
+        for file_name in os.listdir(self.directory):
+            if file_name.startswith("beta_") and file_name.endswith(".pickle"):
+                betas.append(float(file_name[len("beta_") : -len(".pickle")]))
+        return sorted(betas)
+
+    def clear_betas(self):
+        r"""Deletes the stored betas, keeping the store."""
+        for beta in self.get_betas():
+            os.remove(self.beta_file(beta))
+
+    def clear(self):
+        r"""Deletes the store, e.g. once the whole multi_beta_result is written."""
+        shutil.rmtree(self.directory, ignore_errors=True)
+
+
 # class MHETS_results:
 #     r"""Structure that handles the QMEETS instances results.
 
@@ -16,7 +16,6 @@ import re
 from qiskit_ibm_provider import IBMProvider
 from qiskit_aer.noise import NoiseModel
 from qiskit.providers.aer import AerSimulator
-from qiskit.quantum_info import partial_trace
 
 
 from library.ansatz_creation import two_local, pma
@@ -47,6 +46,10 @@ def setup_optimization_options(
     flag,
     tol,
     shots,
+    estimator="tomography",
+    recorder_options=None,
+    cache_options=None,
+    seed=None,
 ):
     optimization_options = {}
     for key in get_ansatz_options(ancilla_ansatz):
@@ -59,6 +62,14 @@ def setup_optimization_options(
     optimization_options["flag"] = flag
     optimization_options["tol"] = tol
     optimization_options["shots"] = shots
+    optimization_options["estimator"] = estimator
+    optimization_options["recorder_options"] = (
+        recorder_options if recorder_options is not None else {}
+    )
+    # None: default of MHETS_instance (on in statevector mode only)
+    optimization_options["cache_options"] = cache_options
+    # Seed of the random generator of MHETS_instance, None: not reproducible
+    optimization_options["seed"] = seed
 
     return optimization_options
 
@@ -202,11 +213,13 @@ def data_to_rho_s(data, H):
         ancilla_ansatz,
         system_ansatz,
         optimization_options=data["optimization_options"],
+        estimator=data["optimization_options"].get("estimator", "tomography"),
+        recorder_options=data["optimization_options"].get("recorder_options", {}),
+        cache_options=data["optimization_options"].get("cache_options", None),
+        seed=data["optimization_options"].get("seed", None),
     )
     rho_s_list = []
     beta_list = data["betas"]
     for index in range(len(beta_list)):
-        mhets.update_parameters(data["optimized_parameter_list"][index])
-        rho = mhets.QST(mhets.build_total_circuit(), shots=data["optimization_options"]["shots"])
-        rho_s_list.append(partial_trace(rho, range(ancilla_ansatz.get_num_qubits())))
+        rho_s_list.append(mhets.get_system_state(data["optimized_parameter_list"][index]))
     return rho_s_list
@@ -0,0 +1,226 @@
+# -*- coding: utf-8 -*-
+r"""
+Functions to collect and use classical shadows (random single-qubit Pauli measurements).
+
+Each snapshot measures every qubit in a random basis (0 = X, 1 = Y, 2 = Z) once. Snapshots are
+stored compactly: bases as uint8 array of shape (M, n), bits packed with numpy.packbits, so
+the same data can be reused offline by any estimator. The single-qubit inverse channel is
+
+.. math::
+
+    \hat{\rho}_q = 3 U_q^{\dagger}|b_q\rangle\langle b_q|U_q - I
+
+and every estimator is an average over the snapshots of products of these single-qubit terms.
+
+
+
+Created on Mon Oct 19 20:11:52 2026
+
+@author: DeWitt
+"""
+import numpy as np
+from qiskit import transpile
+from qiskit.quantum_info import SparsePauliOp
+
+
+from library import pauli_grouping
+from library.ansatz_creation import run_parameter_binds
+
+
+basis_labels = ["X", "Y", "Z"]
+
+# Eigenstates |b> of X, Y, Z as rows, index [basis, bit]
+eigenstates = np.array(
+    [
+        [[1.0, 1.0], [1.0, -1.0]],
+        [[1.0, 1.0j], [1.0, -1.0j]],
+        [[1.0, 0.0], [0.0, 1.0]],
+    ]
+) / np.array([np.sqrt(2.0), np.sqrt(2.0), 1.0])[:, None, None]
+
+# Single-qubit snapshots 3|b><b| - I, index [basis, bit]
+snapshot_matrices = 3.0 * np.einsum(
+    "abi,abj->abij", eigenstates, eigenstates.conj()
+) - np.eye(2)
+
+
+def get_measured_circuits(circuit, backend, labels, circuit_cache):
+    r"""Returns the transpiled circuit measured in each basis of labels.
+
+    The circuits missing in circuit_cache (dictionary keyed by basis label) are built and
+    transpiled in a single call and added to It, so with a parameterized circuit each of
+    the :math:`3^n` bases is transpiled at most once for all the evaluations.
+    """
+    missing_labels = [label for label in dict.fromkeys(labels) if label not in circuit_cache]
+    if len(missing_labels) > 0:
+        circuits = []
+        for label in missing_labels:
+            measured_circuit = circuit.compose(pauli_grouping.get_basis_change_circuit(label))
+            measured_circuit.measure_all()
+            circuits.append(measured_circuit)
+        circuit_cache.update(zip(missing_labels, transpile(circuits, backend)))
+    return [circuit_cache[label] for label in labels]
+
+
+def collect_snapshots(
+    circuit, backend, num_snapshots, seed=None, circuit_cache=None, parameter_binds=None
+):
+    r"""Measures circuit in random Pauli bases.
+
+    Snapshots with the same bases are run as a single circuit with as many shots.
+
+    Args:
+        circuit: Circuit preparing the state (without measures), possibly parameterized.
+        backend: Backend with run(circuits, shots, memory).
+        num_snapshots: Number of snapshots M.
+        seed: Seed of the random bases.
+        circuit_cache: Dictionary of the transpiled measured circuits of circuit on backend
+            (see get_measured_circuits), kept by the caller to reuse them across calls.
+        parameter_binds: Values {Parameter: [value]} of a parameterized circuit (see
+            ansatz_creation.run_parameter_binds).
+
+    Returns:
+        Dictionary with "bases" (M, n) uint8, "bits" packed along the qubits and "num_qubits".
+    """
+    if circuit_cache is None:
+        circuit_cache = {}
+    rng = np.random.default_rng(seed)
+    num_qubits = circuit.num_qubits
+    bases = rng.integers(0, 3, size=(num_snapshots, num_qubits), dtype=np.uint8)
+    unique_bases, inverse, multiplicities = np.unique(
+        bases, axis=0, return_inverse=True, return_counts=True
+    )
+    inverse = np.ravel(inverse)
+    bits = np.zeros((num_snapshots, num_qubits), dtype=np.uint8)
+    for multiplicity in np.unique(multiplicities):
+        basis_indices = np.flatnonzero(multiplicities == multiplicity)
+        labels = [
+            "".join(basis_labels[b] for b in unique_bases[basis_index][::-1])
+            for basis_index in basis_indices
+        ]
+        job_result = run_parameter_binds(
+            get_measured_circuits(circuit, backend, labels, circuit_cache),
+            backend,
+            int(multiplicity),
+            parameter_binds=parameter_binds,
+            memory=True,
+        )
+        for circuit_index, basis_index in enumerate(basis_indices):
+            outcomes = np.array(
+                [int(key.replace(" ", ""), 2) for key in job_result.get_memory(circuit_index)]
+            )
+            bits[inverse == basis_index] = (outcomes[:, None] >> np.arange(num_qubits)) & 1
+    snapshots = {
+        "bases": bases,
+        "bits": np.packbits(bits, axis=1),
+        "num_qubits": num_qubits,
+    }
+    return snapshots
+
+
+def get_bits(snapshots, qubits=None):
+    r"""Returns the unpacked bits (M, len(qubits)) of the snapshots."""
+    bits = np.unpackbits(snapshots["bits"], axis=1, count=snapshots["num_qubits"])
+    if qubits is not None:
+        bits = bits[:, list(qubits)]
+    return bits
+
+
+def get_bases(snapshots, qubits=None):
+    if qubits is None:
+        return snapshots["bases"]
+    return snapshots["bases"][:, list(qubits)]
+
+
+def pauli_estimate(snapshots, observable, qubits=None):
+    r"""Estimates the expectation value of a SparsePauliOp.
+
+    Args:
+        snapshots: Snapshots dictionary (see collect_snapshots).
+        observable: SparsePauliOp acting on qubits.
+        qubits: Measured qubits the observable acts on (default: all).
+
+    Returns:
+        Expectation value and variance of the estimate.
+    """
+    bases = get_bases(snapshots, qubits)
+    bits = get_bits(snapshots, qubits).astype(int)
+    x = observable.paulis.x
+    z = observable.paulis.z
+    support = x | z
+    # Basis code of each term on each qubit, 3 where the term is the identity
+    codes = np.where(x & z, 1, np.where(x, 0, np.where(z, 2, 3)))
+    match = np.all((bases[:, None, :] == codes[None, :, :]) | ~support[None, :, :], axis=2)
+    signs = 1 - 2 * ((bits @ support.T.astype(int)) % 2)
+    snapshot_values = (match * signs * 3.0 ** np.sum(support, axis=1)) @ np.real(
+        observable.coeffs
+    )
+    mean = np.mean(snapshot_values)
+    variance = np.var(snapshot_values) / len(snapshot_values)
+    return mean, variance
+
+
+def population_estimate(snapshots, qubits=None):
+    r"""Estimates the computational basis populations of the register of qubits.
+
+    The raw estimates can be slightly negative: use project_populations before taking logs.
+    """
+    bases = get_bases(snapshots, qubits)
+    bits = get_bits(snapshots, qubits)
+    # <k_q|rho_q|k_q> = 3 delta(b_q, k_q) - 1 for Z, 1/2 for X and Y
+    diagonal = np.where(
+        (bases == 2)[:, :, None],
+        3.0 * (bits[:, :, None] == np.arange(2)[None, None, :]) - 1.0,
+        0.5,
+    )
+    populations = np.ones((len(bases), 1))
+    for qubit in range(bases.shape[1]):
+        populations = (diagonal[:, qubit, :, None] * populations[:, None, :]).reshape(
+            len(bases), -1
+        )
+    return np.mean(populations, axis=0)
+
+
+def project_populations(populations):
+    r"""Clips negative populations and normalizes."""
+    populations = np.clip(populations, 0.0, None)
+    return populations / np.sum(populations)
+
+
+def density_matrix_estimate(snapshots, qubits=None, chunk_size=256):
+    r"""Estimates the (reduced) density matrix of the register of qubits as average of the
+    snapshots :math:`\bigotimes_q \hat{\rho}_q` (qiskit ordering, qubit 0 is the last factor).
+    Memory is bounded by processing chunk_size snapshots at a time."""
+    bases = get_bases(snapshots, qubits)
+    bits = get_bits(snapshots, qubits)
+    num_qubits = bases.shape[1]
+    rho = np.zeros((2 ** num_qubits, 2 ** num_qubits), dtype=complex)
+    for start in range(0, len(bases), chunk_size):
+        chunk_bases = bases[start : start + chunk_size]
+        chunk_bits = bits[start : start + chunk_size]
+        chunk_rho = np.ones((len(chunk_bases), 1, 1), dtype=complex)
+        for qubit in range(num_qubits):
+            single_qubit = snapshot_matrices[chunk_bases[:, qubit], chunk_bits[:, qubit]]
+            chunk_rho = np.einsum("mij,mkl->mikjl", single_qubit, chunk_rho).reshape(
+                len(chunk_bases), 2 * chunk_rho.shape[1], 2 * chunk_rho.shape[2]
+            )
+        rho += np.sum(chunk_rho, axis=0)
+    return rho / len(bases)
+
+
+def project_density_matrix(rho):
+    r"""Projects a Hermitian unit-trace estimate on the density matrices, clipping negative
+    eigenvalues and normalizing."""
+    w, v = np.linalg.eigh((rho + rho.conj().T) / 2.0)
+    w = np.clip(w, 0.0, None)
+    return (v * (w / np.sum(w))) @ v.conj().T
+
+
+def parity_estimate(snapshots, qubits=None):
+    r"""Estimates the parity :math:`\langle \prod_q Z_q \rangle` of the register of qubits.
+
+    Returns:
+        Parity and variance of the estimate.
+    """
+    num_qubits = get_bases(snapshots, qubits).shape[1]
+    return pauli_estimate(snapshots, SparsePauliOp("Z" * num_qubits), qubits=qubits)
@@ -17,6 +17,9 @@ from qiskit import QuantumCircuit
 from qiskit.primitives import Sampler, Estimator
 
 
+from library import measurement_estimation, pauli_grouping
+
+
 operator_allowed = ["x", "z"]
 op_to_basis_state_dict = {"x": ["-", "+"], "z": ["0", "1"]}
 basis_state_to_par_dict = {"-": -np.pi / 2, "+": np.pi / 2, "0": 0, "1": np.pi}
@@ -271,3 +274,30 @@ def exp_value(circuit, observable, estimator=Estimator()):
     """
     job = estimator.run(circuit, observable)
     return job.result().values[0]
+
+
+def sampled_exp_value(circuit, observable, shots=1024, sampler=Sampler()):
+    r"""Estimates the expectation value of an observable from measurements on a certain statevector.
+
+    The terms of the observable are measured in qubit-wise commuting groups (see pauli_grouping),
+    i.e. one circuit per group instead of one per term.
+
+    Args:
+        circuit: QiskitCircuit which evolves |0> to a certain statevector.
+        observable: SparsePauliOp of the observable you want the expectation value.
+        shots: Number of shots of each circuit.
+        sampler: Qiskit sampler.
+
+    Returns:
+        Estimated expectation value of the provided observable on the provided statevector.
+    """
+    groups = pauli_grouping.group_observable(observable)
+    job = sampler.run(pauli_grouping.measurement_circuits(circuit, groups), shots=shots)
+    value = 0.0
+    for group, quasi_dist in zip(groups, job.result().quasi_dists):
+        outcomes = np.array(list(quasi_dist.keys()), dtype=np.int64)
+        frequencies = np.array(list(quasi_dist.values())) * shots
+        value += measurement_estimation.group_expectation_estimate(
+            group, outcomes, frequencies, group.num_qubits
+        )[0]
+    return value
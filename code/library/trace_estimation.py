@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+r"""
+Functions to estimate thermal averages with random vectors when exact diagonalization is
+too expensive (typical pure states / Hutchinson trace estimation).
+
+For each random vector :math:`|r\rangle`, a Lanczos run on the sparse Hamiltonian builds
+the Krylov basis V and the tridiagonal T. Then, for every beta at once,
+
+.. math::
+
+    e^{-\beta H/2}|r\rangle \approx \|r\| V e^{-\beta T/2} e_1
+
+and :math:`\langle O \rangle_{\beta} \approx \sum_r \langle r|e^{-\beta H/2} O e^{-\beta H/2}|r\rangle / \sum_r \langle r|e^{-\beta H}|r\rangle`.
+
+
+
+Created on Mon Oct 19 10:12:36 2026
+
+@author: DeWitt
+"""
+import numpy as np
+from scipy.linalg import eigh_tridiagonal
+from qiskit.quantum_info import SparsePauliOp
+
+
+def random_phase_vector(dimension, rng):
+    r"""Random vector with entries :math:`e^{i\phi}`, so that :math:`E[|r\rangle\langle r|] = I`."""
+    return np.exp(2j * np.pi * rng.random(dimension))
+
+
+def lanczos(H, v0, krylov_dim=40):
+    r"""Lanczos tridiagonalization of H starting from v0, with full reorthogonalization.
+
+    Args:
+        H: Hermitian operator supporting @ (scipy sparse matrix or numpy array).
+        v0: Starting vector (It gets normalized).
+        krylov_dim: Maximum dimension of the Krylov space.
+
+    Returns:
+        Krylov basis as columns, diagonal and off-diagonal of T. The run stops earlier if an
+        invariant subspace is found.
+    """
+    dimension = len(v0)
+    krylov_dim = min(krylov_dim, dimension)
+    V = np.zeros((dimension, krylov_dim), dtype=complex)
+    alpha = np.zeros(krylov_dim)
+    off_diagonal = np.zeros(krylov_dim)
+    V[:, 0] = v0 / np.linalg.norm(v0)
+    for j in range(krylov_dim):
+        w = H @ V[:, j]
+        alpha[j] = np.real(np.vdot(V[:, j], w))
+        w = w - V[:, : j + 1] @ (V[:, : j + 1].conj().T @ w)
+        w = w - V[:, : j + 1] @ (V[:, : j + 1].conj().T @ w)  # Twice is enough
+        off_diagonal[j] = np.linalg.norm(w)
+        if j == krylov_dim - 1 or off_diagonal[j] < 1e-12:
+            return V[:, : j + 1], alpha[: j + 1], off_diagonal[:j]
+        V[:, j + 1] = w / off_diagonal[j]
+
+
+def stochastic_thermal_average(H, op, betas, num_vectors=20, krylov_dim=40, seed=None):
+    r"""Estimates thermal averages for many betas from the same Lanczos runs.
+
+    Args:
+        H: Hamiltonian as scipy sparse matrix or numpy array.
+        op: Observable as SparsePauliOp, scipy sparse matrix or numpy array.
+        betas: List of inverse temperatures.
+        num_vectors: Number of random vectors.
+        krylov_dim: Dimension of the Krylov space of each run.
+        seed: Seed of the random vectors.
+
+    Returns:
+        Dictionary with the betas, the thermal averages, their standard errors and the
+        estimate of :math:`\log Z` with Its standard error.
+    """
+    if isinstance(op, SparsePauliOp):
+        op = op.to_matrix(sparse=True).tocsr()
+    betas = np.atleast_1d(np.asarray(betas, dtype=float))
+    rng = np.random.default_rng(seed)
+    dimension = H.shape[0]
+    runs = []
+    for _ in range(num_vectors):
+        r = random_phase_vector(dimension, rng)
+        V, alpha, off_diagonal = lanczos(H, r, krylov_dim=krylov_dim)
+        theta, S = eigh_tridiagonal(alpha, off_diagonal)
+        G = V.conj().T @ (op @ V)  # Observable projected on the Krylov space
+        runs.append((theta, S, G, np.linalg.norm(r)))
+    # Common energy shift to avoid overflows at large beta
+    energy_shift = min(run[0][0] for run in runs)
+    numerators = np.zeros((num_vectors, len(betas)), dtype=complex)
+    denominators = np.zeros((num_vectors, len(betas)))
+    for run_index, (theta, S, G, r_norm) in enumerate(runs):
+        # Columns are the Krylov coefficients of e^{-beta (H - shift)/2}|r> for each beta
+        half_weights = np.exp(-np.outer(theta - energy_shift, betas) / 2.0)
+        coefficients = r_norm * S @ (half_weights * S[0, :, None])
+        numerators[run_index] = np.sum(coefficients.conj() * (G @ coefficients), axis=0)
+        denominators[run_index] = np.sum(np.abs(coefficients) ** 2, axis=0)
+    average = np.sum(numerators, axis=0) / np.sum(denominators, axis=0)
+    mean_denominator = np.mean(denominators, axis=0)
+    if num_vectors > 1:
+        # Delta method for the ratio estimator
+        residuals = numerators - average * denominators
+        error = np.sqrt(
+            np.sum(np.abs(residuals) ** 2, axis=0) / (num_vectors * (num_vectors - 1))
+        ) / mean_denominator
+        log_Z_error = np.std(denominators, axis=0, ddof=1) / (
+            np.sqrt(num_vectors) * mean_denominator
+        )
+    else:
+        error = np.full(len(betas), np.nan)
+        log_Z_error = np.full(len(betas), np.nan)
+    result = {
+        "betas": betas,
+        "average": average,
+        "error": error,
+        "log_partition_function": np.log(mean_denominator) - betas * energy_shift,
+        "log_partition_function_error": log_Z_error,
+    }
+    return result
@@ -11,8 +11,7 @@ import pickle
 import numpy as np
 
 
-from qiskit.quantum_info import partial_trace
-from library import plotting, setup
+from library import plotting, setup, reference_store
 from library.operator_creation import LMG_hamiltonian
 from library.MHETS import MHETS_instance
 
@@ -22,6 +21,8 @@ N = 4
 gy = 0.25
 B = 0.1
 H = LMG_hamiltonian(N, gy, B)
+# Exact spectrum and thermal tables are computed once and reused by every session
+reference_store.attach_reference(H, path="./reference_data/")
 
 
 path = "./MHETS_data/"
@@ -51,9 +52,7 @@ mhets = MHETS_instance(
 )
 rho_s_list = []
 for index in range(len(beta_list)):
-    mhets.update_parameters(multi_beta_result["optimized_parameter_list"][index])
-    rho = mhets.QST(mhets.build_total_circuit(), shots=optimization_options["shots"])
-    rho_s_list.append(partial_trace(rho, range(ancilla_ansatz.get_num_qubits())))
+    rho_s_list.append(mhets.get_system_state(multi_beta_result["optimized_parameter_list"][index]))
 plotting.plot_MHETS_thermal_average(beta_list, rho_s_list, H, backend=backend, beta_final=10)
 plotting.plot_fidelity(beta_list, rho_s_list, H, backend=backend)
 plotting.plot_rel_entropy(beta_list, rho_s_list, H, backend=backend)
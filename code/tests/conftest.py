@@ -0,0 +1,14 @@
+# -*- coding: utf-8 -*-
+r"""
+The library is imported as in the scripts (from library import ...), from the code directory.
+
+
+
+Created on Mon Oct 19 23:52:10 2026
+
+@author: DeWitt
+"""
+import os
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
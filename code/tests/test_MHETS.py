@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+r"""
+Tests of the multi beta drivers of MHETS_instance.
+
+
+
+Created on Mon Oct 19 23:52:10 2026
+
+@author: DeWitt
+"""
+import numpy as np
+
+
+from library.MHETS import MHETS_instance
+from library.operator_creation import LMG_hamiltonian
+from library.ansatz_creation import two_local
+
+
+def build_instance(num_betas):
+    N = 2
+    ancilla_ansatz = two_local(num_qubits=N, par_name="x")
+    system_ansatz = two_local(num_qubits=N, par_name="y")
+    num_parameters = ancilla_ansatz.get_num_parameters() + system_ansatz.get_num_parameters()
+    optimization_options = {
+        "maxiter": 20,
+        "optimizer": "COBYLA",
+        "initial_parameter_list": [np.zeros(num_parameters) for _ in range(num_betas)],
+        "flag": "statevector",
+        "tol": 1e-1,
+        "shots": None,
+    }
+    return MHETS_instance(
+        H=LMG_hamiltonian(N, gy=0.8, B=0.4),
+        ancilla_ansatz=ancilla_ansatz,
+        system_ansatz=system_ansatz,
+        optimization_options=optimization_options,
+    )
+
+
+def test_from_data_pads_old_format_data():
+    mhets = build_instance(num_betas=5)
+    old_betas = [0.5, 1.0, 2.0]
+    # MHETS_data written before n_grad, estimator and n_cache_hits existed
+    old_data = {
+        "betas": list(old_betas),
+        "optimization_options": mhets.optimization_options,
+        "backend": None,
+        "optimized_parameter_list": [np.full(8, beta) for beta in old_betas],
+        "Helmoltz energy": [-beta for beta in old_betas],
+        "Time optimization": [0.0 for _ in old_betas],
+        "n_eval": [1 for _ in old_betas],
+        "callback_data": [None for _ in old_betas],
+    }
+    betas = [0.5, 0.7, 1.0, 1.5, 2.0]
+    result = mhets.multi_beta_optimization_from_data(betas=betas, old_data=old_data)
+
+    assert result["betas"] == betas
+    for key, values in result.items():
+        if key not in ["optimization_options", "backend"]:
+            assert len(values) == len(betas), key
+    for index, beta in enumerate(betas):
+        if beta in old_betas:
+            assert result["Helmoltz energy"][index] == -beta
+            assert np.all(result["optimized_parameter_list"][index] == beta)
+            for key in ["n_grad", "estimator", "n_cache_hits"]:
+                assert result[key][index] is None
+        else:
+            assert result["estimator"][index] == "tomography"
+            assert result["n_cache_hits"][index] is not None